@@ -0,0 +1,96 @@
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailer.message import MessageTemplate
+
+MB = 1024 * 1024
+
+
+def create_message(sender, to, subject, body, attachments):
+    # The original builder: the whole MIME message, attachments included, built and encoded per recipient
+    message = MIMEMultipart()
+    message['to'] = to
+    message['from'] = sender
+    message['subject'] = subject
+    message.attach(MIMEText(body, 'html'))
+    for file in attachments:
+        with open(file, 'rb') as f:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(f.read())
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', f'attachment; filename="{os.path.basename(file)}"')
+            message.attach(part)
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    return {'raw': raw}
+
+
+def per_message(fn, count):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(f"recipient{i}@example.com")
+    return (time.perf_counter() - start) / count
+
+
+def read_through(stream, chunksize):
+    # What the resumable upload does with a streamed message
+    while stream.read(chunksize):
+        pass
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message MIME build cost: create_message vs MessageTemplate")
+    parser.add_argument('--attachment-mb', type=float, default=5.0)
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--max-message-mb', type=float, default=4.0, help="memory ceiling for the streamed template")
+    args = parser.parse_args()
+
+    body = "<html><body><p>Hello from the benchmark.</p></body></html>"
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(os.urandom(int(args.attachment_mb * 1024 * 1024)))
+        attachment = f.name
+    try:
+        old = per_message(lambda to: create_message("sender@example.com", to, "Subject", body, [attachment]), args.count)
+        start = time.perf_counter()
+        # Ceiling high enough that the whole message stays in memory, as before streaming existed
+        template = MessageTemplate("Subject", body, [attachment], max_message_memory=int(4 * args.attachment_mb * MB) + MB)
+        setup = time.perf_counter() - start
+        new = per_message(lambda to: template.render("sender@example.com", to), args.count)
+        inline_peak = peak_memory(lambda: template.render("sender@example.com", "recipient@example.com"))
+        template.close()
+        streamed = MessageTemplate("Subject", body, [attachment], max_message_memory=int(args.max_message_mb * MB))
+        streamed_peak = peak_memory(lambda: read_through(streamed.stream("sender@example.com", "recipient@example.com"),
+                                                         streamed.chunksize))
+        streamed.close()
+    finally:
+        os.remove(attachment)
+    print(f"attachment: {args.attachment_mb} MB, messages: {args.count}")
+    print(f"create_message:          {old * 1000:10.3f} ms/message")
+    print(f"MessageTemplate.render:  {new * 1000:10.3f} ms/message (one-time setup {setup * 1000:.1f} ms)")
+    print(f"speedup:                 {old / new:10.1f}x")
+    mode = "streamed" if streamed.streamed else "inline (fits the ceiling)"
+    print(f"peak memory, inline:     {inline_peak / MB:10.1f} MB/message")
+    print(f"peak memory, {args.max_message_mb:g} MB cap: {streamed_peak / MB:10.1f} MB/message, {mode}")
+
+
+if __name__ == '__main__':
+    main()
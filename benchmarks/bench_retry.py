@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailer.engine import SendEngine
+from mailer.gmail_service import ServicePool
+from mailer.metrics import Metrics
+from mailer.retry import RetryPolicy
+from mailer.validation import RecipientValidator
+from tests.fake_gmail import FakeGmail, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a campaign against a local fake Gmail with injected failures")
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--invalid', type=int, default=5, help="recipients the server rejects permanently")
+    parser.add_argument('--senders', type=int, default=3)
+    parser.add_argument('--daily-limit', type=int, default=200, help="per account, enforced by the fake server")
+    parser.add_argument('--transient-rate', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    from google.oauth2.credentials import Credentials
+
+    gmail = FakeGmail(args.transient_rate, args.daily_limit)
+    server, endpoint = serve(gmail)
+
+    senders = [{'email': f'sender{i}@example.com', 'creds': Credentials(token=f'sender{i}@example.com'),
+                'token_path': f'sender{i}', 'limit': 500} for i in range(args.senders)]
+    recipients = [f'user{i}@example.com' for i in range(args.recipients)] + \
+        [f'bad{i}@example.com' for i in range(args.invalid)]
+    metrics = Metrics()
+    engine = SendEngine(senders, recipients, "Subject", "<p>Hello</p>", [], concurrency=args.concurrency,
+                        service_pool=ServicePool(api_endpoint=endpoint, metrics=metrics),
+                        validator=RecipientValidator(check_deliverability=False), metrics=metrics,
+                        retry=RetryPolicy(base_delay=0.05, max_delay=1.0))
+    start = time.perf_counter()
+    try:
+        failed = engine.run()
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    capacity = min(args.recipients, args.senders * args.daily_limit)
+    print(f"recipients: {args.recipients} (+{args.invalid} rejected), capacity: {args.senders} x {args.daily_limit}")
+    print(f"delivered:  {len(gmail.delivered)} unique of {capacity} possible, "
+          f"{sum(n > 1 for n in gmail.delivered.values())} duplicates, {elapsed:.1f} s")
+    print(f"failed:     {len(failed)} ({sum(a.startswith('bad') for a in failed)} permanent rejections)")
+    print(f"retries:    {sum(snapshot['retries'].values())} {snapshot['retries']}")
+    print(f"per sender: {gmail.sent}")
+
+
+if __name__ == '__main__':
+    main()
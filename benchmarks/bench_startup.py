@@ -0,0 +1,48 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mailer.senders import load_senders, write_meta
+
+
+def import_time(module, repeat):
+    # Fresh interpreter each time so nothing is already in sys.modules
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], cwd=ROOT, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Customer dashboard startup cost")
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    baseline = import_time('PyQt5.QtWidgets', args.repeat)
+    dashboard = import_time('gui.customer_dashboard', args.repeat)
+    print(f"import PyQt5.QtWidgets:       {baseline * 1000:8.1f} ms")
+    print(f"import gui.customer_dashboard: {dashboard * 1000:8.1f} ms ({(dashboard - baseline) * 1000:.1f} ms over Qt)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.senders):
+            token_path = os.path.join(directory, f'token_sender{i}@gmail.com.pickle')
+            open(token_path, 'wb').close()
+            write_meta(token_path, f'sender{i}@gmail.com')
+        start = time.perf_counter()
+        senders = load_senders(directory)
+        elapsed = time.perf_counter() - start
+    print(f"load_senders ({len(senders)} tokens):   {elapsed * 1000:8.1f} ms (no network, no unpickling)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ensure_indexes, USER_SESSION_FIELDS, USERNAME_ONLY
+
+BENCH_DB = 'bulk_email_app_bench'
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def docs_examined(collection, query, projection=None):
+    plan = collection.find(query, projection).explain()
+    stats = plan.get('executionStats', {})
+    return stats.get('totalDocsExamined', 'n/a')
+
+
+def run(db, users, repeat):
+    login = lambda i: db.users.find_one({"username": f"user{i * 7919 % users}", "password": "secret"})
+    login_projected = lambda i: db.users.find_one({"username": f"user{i * 7919 % users}", "password": "secret"}, USER_SESSION_FIELDS)
+    pending = lambda i: list(db.users.find({"role": "customer", "active": False}))
+    pending_projected = lambda i: list(db.users.find({"role": "customer", "active": False}, USERNAME_ONLY))
+    return {
+        'login': timed(login, repeat),
+        'login (projected)': timed(login_projected, repeat),
+        'pending users': timed(pending, max(1, repeat // 10)),
+        'pending users (projected)': timed(pending_projected, max(1, repeat // 10)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="users collection queries before and after index provisioning")
+    parser.add_argument('--uri', default=os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--mongomock', action='store_true', help="use mongomock instead of a local mongod")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri, serverSelectionTimeoutMS=3000)
+    client.drop_database(BENCH_DB)
+    db = client[BENCH_DB]
+    padding = 'x' * 512
+    db.users.insert_many([
+        {"username": f"user{i}", "password": "secret", "role": "customer", "active": i % 20 != 0, "notes": padding}
+        for i in range(args.users)
+    ])
+    try:
+        before = run(db, args.users, args.repeat)
+        if not args.mongomock:
+            scanned = docs_examined(db.users, {"username": "user1", "password": "secret"})
+        ensure_indexes(db)
+        after = run(db, args.users, args.repeat)
+        print(f"users: {args.users}, backend: {'mongomock' if args.mongomock else args.uri}")
+        for name in before:
+            print(f"{name:28} {before[name]:9.3f} ms -> {after[name]:9.3f} ms")
+        if not args.mongomock:
+            print(f"login docs examined: {scanned} -> {docs_examined(db.users, {'username': 'user1', 'password': 'secret'})}")
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == '__main__':
+    main()
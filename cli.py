@@ -0,0 +1,227 @@
+import argparse
+import csv
+import logging
+import os
+import signal
+import sys
+import threading
+from dotenv import load_dotenv
+from mailer.dispatcher import DEFAULT_CONCURRENCY, MAX_BATCH_SIZE
+from mailer.message import MAX_MESSAGE_MEMORY
+from mailer.metrics import Metrics, DEFAULT_EXPORT_PATH
+from mailer.senders import load_senders
+
+logger = logging.getLogger('cli')
+
+FAILED_PATH = 'failed_emails.csv'
+
+
+def _add_engine_options(parser):
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="parallel sends per sender")
+    parser.add_argument('--batch-size', type=int, default=0, help=f"messages per batch request, up to {MAX_BATCH_SIZE} (0 = off)")
+    parser.add_argument('--max-message-mb', type=int, default=MAX_MESSAGE_MEMORY // (1024 * 1024),
+                        help="larger messages are streamed through resumable uploads")
+
+
+def _add_campaign_options(parser):
+    parser.add_argument('--csv', help="recipients; first column is the address, other columns are merge fields")
+    parser.add_argument('--subject', default='')
+    body = parser.add_mutually_exclusive_group()
+    body.add_argument('--body', help="HTML body")
+    body.add_argument('--body-file', help="file holding the HTML body")
+    parser.add_argument('--attach', action='append', default=[], metavar='PATH')
+    parser.add_argument('--owner', help="customer the campaign belongs to")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description="Bulk email sender. Without a command the desktop app starts.")
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI'), help="defaults to MONGO_URI from .env")
+    parser.add_argument('--tokens', default=os.getcwd(), help="directory holding token_<email>.pickle sender tokens")
+    parser.add_argument('--metrics', default=os.path.join(os.getcwd(), DEFAULT_EXPORT_PATH),
+                        help="metrics export file (.prom or .json)")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send = commands.add_parser('send', help="send one campaign in the foreground")
+    send.add_argument('--campaign', help="id of a queued or interrupted campaign to send")
+    _add_campaign_options(send)
+    _add_engine_options(send)
+    send.add_argument('--failed-out', default=os.path.join(os.getcwd(), FAILED_PATH))
+
+    enqueue = commands.add_parser('enqueue', help="queue a campaign for the workers")
+    _add_campaign_options(enqueue)
+    _add_engine_options(enqueue)
+
+    worker = commands.add_parser('worker', help="send queued campaigns until stopped")
+    _add_engine_options(worker)
+    worker.add_argument('--once', action='store_true', help="exit when the queue is empty")
+    worker.add_argument('--poll', type=float, default=None, help="seconds between queue checks")
+    worker.add_argument('--lease', type=int, default=None, help="seconds a silent worker keeps its campaign")
+    worker.add_argument('--worker-id', help="defaults to <host>:<pid>")
+    return parser
+
+
+def _engine_options(args):
+    return {
+        'concurrency': max(1, args.concurrency),
+        'batch_size': min(max(0, args.batch_size), MAX_BATCH_SIZE),
+        'max_message_memory': max(1, args.max_message_mb) * 1024 * 1024,
+    }
+
+
+def _campaign_fields(parser, args):
+    if not args.csv:
+        parser.error("--csv is required")
+    if args.body_file:
+        with open(args.body_file, 'r', encoding='utf-8') as f:
+            body = f.read()
+    else:
+        body = args.body or ''
+    for path in [args.csv] + args.attach:
+        if not os.path.exists(path):
+            parser.error(f"file not found: {path}")
+    return args.subject, body, [os.path.abspath(path) for path in args.attach], os.path.abspath(args.csv)
+
+
+def _database(args):
+    from db import Database
+    database = Database(args.mongo_uri)
+    database.migrate()
+    return database
+
+
+def _senders(parser, args):
+    senders = load_senders(args.tokens)
+    if not senders:
+        parser.error(f"no sender tokens (token_<email>.pickle) in {args.tokens}")
+    return senders
+
+
+def _on_signals(handler):
+    def on_signal(signum, frame):
+        logger.info("Received %s, stopping", signal.Signals(signum).name)
+        handler()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+
+def _save_failed(path, failed):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows([address] for address in failed)
+    logger.warning("%d emails failed, saved to %s", len(failed), path)
+
+
+def send(parser, args, metrics):
+    from mailer.engine import SendEngine
+    from mailer.quota import QuotaManager
+    from mailer.recipients import RecipientSource
+    from mailer.worker import CampaignFailed, CampaignWorker, ProgressLog
+
+    senders = _senders(parser, args)
+    if args.campaign is None and not args.mongo_uri:
+        # No journal: a plain one-off send
+        subject, body, attachments, source_path = _campaign_fields(parser, args)
+        engine = SendEngine(senders, RecipientSource(source_path), subject, body, attachments,
+                            on_progress=ProgressLog(os.path.basename(source_path)), quota=QuotaManager(None),
+                            metrics=metrics, **_engine_options(args))
+        _on_signals(engine.cancel)
+        failed = engine.run()
+        cancelled = engine.cancelled
+    else:
+        if not args.mongo_uri:
+            parser.error("--campaign needs a database (MONGO_URI or --mongo-uri)")
+        from bson import ObjectId
+        from bson.errors import InvalidId
+        database = _database(args)
+        try:
+            if args.campaign is not None:
+                try:
+                    campaign_id = ObjectId(args.campaign)
+                except InvalidId:
+                    parser.error(f"not a campaign id: {args.campaign}")
+            else:
+                subject, body, attachments, source_path = _campaign_fields(parser, args)
+                campaign_id = _enqueue(database.db, args, subject, body, attachments, source_path, hold=True)
+            worker = CampaignWorker(database.db, senders, quota=QuotaManager(database.db), metrics=metrics,
+                                    engine_options=_engine_options(args))
+            interrupted = threading.Event()
+
+            def interrupt():
+                # Stays resumable with `send --campaign`, but is not handed to the workers
+                interrupted.set()
+                worker.cancel()
+
+            _on_signals(interrupt)
+            try:
+                failed = worker.run_once(campaign_id)
+            except CampaignFailed:
+                logger.error("Campaign %s stopped; resume it with `send --campaign %s`", campaign_id, campaign_id)
+                return 1
+            if failed is None:
+                logger.error("Campaign %s is not waiting to be sent, or another worker holds it", campaign_id)
+                return 2
+            logger.info("Campaign id: %s", campaign_id)
+            cancelled = interrupted.is_set()
+        finally:
+            database.close()
+    if failed:
+        _save_failed(args.failed_out, failed)
+    return 1 if failed or cancelled else 0
+
+
+def _enqueue(db, args, subject, body, attachments, source_path, hold=False):
+    from mailer.journal import CampaignJournal
+    journal = CampaignJournal.enqueue(db, args.owner or os.getenv('USER', 'cli'), subject, body, attachments,
+                                      source_path, options=_engine_options(args), hold=hold)
+    return journal.campaign_id
+
+
+def enqueue(parser, args):
+    if not args.mongo_uri:
+        parser.error("queueing needs a database (MONGO_URI or --mongo-uri)")
+    subject, body, attachments, source_path = _campaign_fields(parser, args)
+    database = _database(args)
+    try:
+        campaign_id = _enqueue(database.db, args, subject, body, attachments, source_path)
+    finally:
+        database.close()
+    print(campaign_id)
+    return 0
+
+
+def worker(parser, args, metrics):
+    from mailer.quota import QuotaManager
+    from mailer.worker import CampaignWorker
+
+    if not args.mongo_uri:
+        parser.error("the worker needs a database (MONGO_URI or --mongo-uri)")
+    senders = _senders(parser, args)
+    database = _database(args)
+    options = {name: value for name, value in (('poll_interval', args.poll), ('lease', args.lease),
+                                                ('worker_id', args.worker_id)) if value is not None}
+    campaign_worker = CampaignWorker(database.db, senders, quota=QuotaManager(database.db), metrics=metrics,
+                                     engine_options=_engine_options(args), **options)
+    _on_signals(campaign_worker.stop)
+    try:
+        campaign_worker.run(once=args.once)
+    finally:
+        database.close()
+    return 0
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    metrics = Metrics(export_path=args.metrics)
+    if args.command == 'send':
+        return send(parser, args, metrics)
+    if args.command == 'enqueue':
+        return enqueue(parser, args)
+    return worker(parser, args, metrics)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import threading
+import logging
+from pymongo import MongoClient, monitoring, ASCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = 'bulk_email_app'
+
+POOL_OPTIONS = {
+    'maxPoolSize': 20,
+    'minPoolSize': 1,
+    'maxIdleTimeMS': 5 * 60 * 1000,
+    'connectTimeoutMS': 10000,
+    'serverSelectionTimeoutMS': 10000,
+    'retryWrites': True,
+    'appname': 'bulk-email-sender',
+}
+
+
+# Projections used by the query call sites; user documents are never loaded whole
+USER_SESSION_FIELDS = {'username': 1, 'role': 1, 'active': 1}
+USERNAME_ONLY = {'username': 1, '_id': 0}
+
+INDEXES = {
+    'users': [
+        ([('username', ASCENDING)], {'unique': True, 'name': 'username_unique'}),
+        ([('role', ASCENDING), ('active', ASCENDING), ('username', ASCENDING)], {'name': 'role_active_username'}),
+    ],
+    'campaign_recipients': [
+        ([('campaign_id', ASCENDING), ('status', ASCENDING), ('key', ASCENDING)], {'name': 'campaign_status_key'}),
+    ],
+    'campaigns': [
+        ([('owner', ASCENDING), ('status', ASCENDING), ('updated_at', ASCENDING)], {'name': 'owner_status_updated'}),
+        ([('status', ASCENDING), ('created_at', ASCENDING)], {'name': 'status_created'}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except PyMongoError as e:
+                logger.error("Could not create index %s on %s: %s", options['name'], collection, e)
+
+
+class _Stats(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+
+    def _finished(self, event, failed):
+        ms = event.duration_micros / 1000.0
+        with self._lock:
+            self.commands += 1
+            self.failures += failed
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finished(event, 0)
+
+    def failed(self, event):
+        self._finished(event, 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'commands': self.commands,
+                'failures': self.failures,
+                'avg_ms': self.total_ms / self.commands if self.commands else 0.0,
+                'max_ms': self.max_ms,
+                'connections_open': self.connections_created - self.connections_closed,
+                'connections_created': self.connections_created,
+                'checkouts': self.checkouts,
+            }
+
+
+class Database:
+    # One pooled MongoClient for the whole process, created on first use and
+    # shared by every window (MongoClient is thread-safe).
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = dict(POOL_OPTIONS, **options)
+        self.stats_listener = _Stats()
+        self._client = None
+        self._migrated = False
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.uri)
+
+    @property
+    def client(self):
+        if not self.uri:
+            return None
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = MongoClient(self.uri, event_listeners=[self.stats_listener], **self.options)
+        return self._client
+
+    @property
+    def db(self):
+        client = self.client
+        return client[DB_NAME] if client is not None else None
+
+    def migrate(self):
+        # Idempotent startup step; create_index is a no-op for existing indexes
+        if self._migrated or not self.uri:
+            return
+        ensure_indexes(self.db)
+        self._migrated = True
+
+    def stats(self):
+        return self.stats_listener.snapshot()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                logger.info("Closing MongoDB client: %s", self.stats())
+                self._client.close()
+                self._client = None
@@ -1,15 +1,24 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QListWidget, QMessageBox
-from pymongo import MongoClient
+import re
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QListWidget, QMessageBox, QLineEdit, QComboBox, QAbstractItemView
+from PyQt5.QtCore import QTimer
+from gui.db_tasks import DbExecutor
+from db import USERNAME_ONLY
+
+PAGE_SIZE = 50
+SEARCH_DELAY_MS = 300
 
 class AdminDashboard(QWidget):
-    def __init__(self, mongo_uri):
+    def __init__(self, database):
         super().__init__()
         self.setWindowTitle("Admin Dashboard")
         self.setGeometry(150, 150, 500, 400)
-        self.mongo_uri = mongo_uri
-        self.client = MongoClient(self.mongo_uri) if self.mongo_uri else None
-        self.db = self.client['bulk_email_app'] if self.client else None
+        self.database = database
+        self.db = self.database.db if self.database else None
         self.logout_success = None
+        self.executor = DbExecutor(parent=self)
+        self.cursor = None
+        self.has_more = False
+        self.page_key = None
         self.init_ui()
         self.center()
         self.load_pending_users()
@@ -18,11 +27,34 @@ class AdminDashboard(QWidget):
         layout = QVBoxLayout()
         self.label = QLabel("Pending Customer Activations")
         self.label.setStyleSheet("font-size: 20px; font-weight: bold; color: #1976d2;")
+        self.view_select = QComboBox()
+        self.view_select.addItems(["Pending customers", "Active customers"])
+        self.view_select.currentIndexChanged.connect(self.on_view_changed)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search username")
+        self.search_input.setStyleSheet("padding: 6px; border-radius: 5px; border: 1px solid #cfd8dc;")
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.load_pending_users)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        filters = QHBoxLayout()
+        filters.addWidget(self.view_select)
+        filters.addWidget(self.search_input)
         self.user_list = QListWidget()
+        self.user_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.user_list.setStyleSheet("background: #fff; border: 1px solid #cfd8dc; border-radius: 4px; padding: 6px;")
+        self.count_label = QLabel("")
+        self.count_label.setStyleSheet("font-size: 13px; color: #546e7a;")
+        self.more_btn = QPushButton("Load More")
+        self.more_btn.setStyleSheet("background: #f5f5f5; color: #333; border-radius: 6px; padding: 8px 16px; font-size: 14px; border: 1px solid #bdbdbd;")
+        self.more_btn.clicked.connect(self.load_more_users)
         self.activate_btn = QPushButton("Activate Selected")
         self.activate_btn.setStyleSheet("background: #43a047; color: white; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
         self.activate_btn.clicked.connect(self.activate_user)
+        self.deactivate_btn = QPushButton("Deactivate Selected")
+        self.deactivate_btn.setStyleSheet("background: #fb8c00; color: white; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
+        self.deactivate_btn.clicked.connect(self.deactivate_user)
         self.reset_btn = QPushButton("Reset List")
         self.reset_btn.setStyleSheet("background: #bdbdbd; color: #222; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
         self.reset_btn.clicked.connect(self.reset_fields)
@@ -30,12 +62,17 @@ class AdminDashboard(QWidget):
         self.logout_btn.setStyleSheet("background: #e53935; color: white; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
         self.logout_btn.clicked.connect(self.logout)
         layout.addWidget(self.label)
+        layout.addLayout(filters)
         layout.addWidget(self.user_list)
+        layout.addWidget(self.count_label)
+        layout.addWidget(self.more_btn)
         layout.addWidget(self.activate_btn)
+        layout.addWidget(self.deactivate_btn)
         layout.addWidget(self.reset_btn)
         layout.addWidget(self.logout_btn)
         self.setLayout(layout)
         self.setStyleSheet("background: #f7f9fa; font-family: 'Segoe UI', Arial, sans-serif; font-size: 14px;")
+        self.update_view_buttons()
 
     def center(self):
         qr = self.frameGeometry()
@@ -43,24 +80,117 @@ class AdminDashboard(QWidget):
         qr.moveCenter(cp)
         self.move(qr.topLeft())
 
+    def showing_active(self):
+        return self.view_select.currentIndex() == 1
+
+    def update_view_buttons(self):
+        active = self.showing_active()
+        self.label.setText("Active Customers" if active else "Pending Customer Activations")
+        self.activate_btn.setVisible(not active)
+        self.deactivate_btn.setVisible(active)
+        self.more_btn.setEnabled(self.has_more)
+
+    def on_view_changed(self, index):
+        self.update_view_buttons()
+        self.load_pending_users()
+
+    def page_query(self, after):
+        # Keyset pagination on username; with the (role, active, username)
+        # index and a username-only projection every page is a covered query
+        query = {"role": "customer", "active": self.showing_active()}
+        username = {}
+        search = self.search_input.text().strip()
+        if search:
+            username["$regex"] = "^" + re.escape(search)
+        if after is not None:
+            username["$gt"] = after
+        if username:
+            query["username"] = username
+        return query
+
+    def fetch_page(self, query):
+        cursor = self.db.users.find(query, USERNAME_ONLY).sort("username", 1).limit(PAGE_SIZE + 1)
+        usernames = [user['username'] for user in cursor]
+        return usernames[:PAGE_SIZE], len(usernames) > PAGE_SIZE
+
     def load_pending_users(self):
         self.user_list.clear()
-        users = self.db.users.find({"role": "customer", "active": False})
-        for user in users:
-            self.user_list.addItem(user['username'])
+        self.cursor = None
+        self.has_more = False
+        self.load_more_users()
 
-    def activate_user(self):
-        selected = self.user_list.currentItem()
-        if not selected:
+    def load_more_users(self):
+        after = self.cursor
+        query = self.page_query(after)
+        # A new search or view replaces any page still loading
+        key = f"page:{self.view_select.currentIndex()}:{self.search_input.text().strip()}:{after}"
+        self.executor.submit(
+            key,
+            lambda: self.fetch_page(query),
+            lambda page: self.on_page_loaded(key, page),
+            self.on_db_error,
+            busy=self.more_btn,
+        )
+        self.page_key = key
+
+    def on_page_loaded(self, key, page):
+        if key != self.page_key:
+            return
+        usernames, has_more = page
+        self.user_list.addItems(usernames)
+        if usernames:
+            self.cursor = usernames[-1]
+        self.has_more = has_more
+        self.count_label.setText(f"{self.user_list.count()} shown" + (" (more available)" if has_more else ""))
+        self.more_btn.setEnabled(has_more)
+
+    def selected_usernames(self):
+        return [item.text() for item in self.user_list.selectedItems()]
+
+    def set_active(self, active):
+        usernames = self.selected_usernames()
+        if not usernames:
             QMessageBox.warning(self, "Error", "No user selected.")
             return
-        username = selected.text()
-        self.db.users.update_one({"username": username}, {"$set": {"active": True}})
-        QMessageBox.information(self, "Activated", f"{username} has been activated.")
-        self.load_pending_users()
+        self.executor.submit(
+            'set_active',
+            lambda: self.db.users.update_many(
+                {"username": {"$in": usernames}, "role": "customer"},
+                {"$set": {"active": active}},
+            ).modified_count,
+            lambda modified: self.on_users_updated(usernames, active, modified),
+            self.on_db_error,
+            busy=[self.activate_btn, self.deactivate_btn],
+        )
+
+    def activate_user(self):
+        self.set_active(True)
+
+    def deactivate_user(self):
+        self.set_active(False)
+
+    def on_users_updated(self, usernames, active, modified):
+        # Drop the changed rows in place instead of reloading the page
+        names = set(usernames)
+        for row in reversed(range(self.user_list.count())):
+            if self.user_list.item(row).text() in names:
+                self.user_list.takeItem(row)
+        self.count_label.setText(f"{self.user_list.count()} shown" + (" (more available)" if self.has_more else ""))
+        if len(usernames) == 1:
+            state = "activated" if active else "deactivated"
+            QMessageBox.information(self, "Updated", f"{usernames[0]} has been {state}.")
+        else:
+            state = "Activated" if active else "Deactivated"
+            QMessageBox.information(self, "Updated", f"{state} {modified} of {len(usernames)} users.")
+        if self.has_more and self.user_list.count() < PAGE_SIZE:
+            self.load_more_users()
+
+    def on_db_error(self, error):
+        QMessageBox.critical(self, "Error", f"Database error: {error}")
 
     def reset_fields(self):
         self.user_list.clear()
+        self.count_label.clear()
 
     def logout(self):
         from session import clear_session
@@ -0,0 +1,40 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Threads that outlived the window that started them, see detach()
+_detached = set()
+
+
+class BackgroundTask(QThread):
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, fn, *args, parent=None, **kwargs):
+        super().__init__(parent)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.succeeded.emit(result)
+
+
+def detach(thread):
+    # Lets a running thread finish without its window waiting for it: its
+    # signals are disconnected, and it is reparented and kept referenced
+    # until it finishes, so deleting the window does not destroy it.
+    thread.disconnect()
+    thread.setParent(None)
+    _detached.add(thread)
+    thread.finished.connect(lambda: _detached.discard(thread))
+    thread.finished.connect(thread.deleteLater)
+
+
+def wait_detached():
+    # On quit, once the windows are gone: let detached threads wind down
+    for thread in list(_detached):
+        thread.wait()
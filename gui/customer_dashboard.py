@@ -1,42 +1,59 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QListWidget, QMessageBox, QLineEdit, QInputDialog, QTextEdit, QHBoxLayout
-import pandas as pd
-from pymongo import MongoClient
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QListWidget, QMessageBox, QLineEdit, QInputDialog, QTextEdit, QHBoxLayout, QProgressBar, QSpinBox
+from PyQt5.QtCore import QTimer
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email_validator import validate_email, EmailNotValidError
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-import pickle
+import csv
 import logging
-import glob
+import threading
+from gui.send_worker import SendWorker
+from gui.background import BackgroundTask, detach
+from gui.db_tasks import DbExecutor
+from gui.list_models import CompactListModel, compact_list_view
+from mailer.dispatcher import DEFAULT_CONCURRENCY, MAX_BATCH_SIZE
+from mailer.gmail_service import ServicePool
+from mailer.message import MAX_MESSAGE_MEMORY
+from mailer.metrics import Metrics, DEFAULT_EXPORT_PATH
+from mailer.recipients import RecipientSource, CompactStringStore
+from mailer.journal import CampaignJournal
+from mailer.quota import QuotaManager
+from mailer.senders import DEFAULT_LIMIT, load_senders, refresh_profiles, save_credentials
+from mailer.templating import MailMerge, field_index
 
 logging.basicConfig(filename='customer_dashboard_debug.log', level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
 
+STATS_INTERVAL_MS = 1000
+
 class CustomerDashboard(QWidget):
-    def __init__(self, mongo_uri, user_email):
+    def __init__(self, database, user_email):
         super().__init__()
         self.setWindowTitle("Customer Dashboard")
         self.setGeometry(200, 200, 600, 500)
-        self.mongo_uri = mongo_uri
+        self.database = database
         self.user_email = user_email
-        self.client = MongoClient(self.mongo_uri) if self.mongo_uri else None
-        self.db = self.client['bulk_email_app'] if self.client else None
+        self.db = self.database.db if self.database else None
         self.logout_success = None
-        self.init_ui()
-        self.center()
+        self.metrics = Metrics(export_path=os.path.join(os.getcwd(), DEFAULT_EXPORT_PATH))
+        self.service_pool = ServicePool(metrics=self.metrics)
+        self.quota = QuotaManager(self.db)
+        self.executor = DbExecutor(parent=self)
         self.sender_emails = []
         self.failed_emails = []
-        self.dest_emails = []
+        self.recipient_source = None
+        self.csv_task = None
+        self.profile_task = None
+        self.send_worker = None
+        # Cleared on logout/close; stops a CSV scan at its next chunk
+        self.alive = threading.Event()
+        self.alive.set()
+        self.init_ui()
+        self.center()
 
     def init_ui(self):
         layout = QVBoxLayout()
         self.label = QLabel(f"Welcome, {self.user_email}")
         self.add_sender_btn = QPushButton("Add Gmail Sender Account (OAuth)")
         self.add_sender_btn.clicked.connect(self.add_sender)
-        self.sender_list = QListWidget()
+        self.sender_model = CompactListModel(parent=self)
+        self.sender_list = compact_list_view(self.sender_model)
         self.reset_sender_btn = QPushButton("Reset Senders")
         self.reset_sender_btn.clicked.connect(self.reset_senders)
         self.subject_input = QLineEdit()
@@ -54,11 +71,59 @@ class CustomerDashboard(QWidget):
         self.reset_attach_btn.clicked.connect(self.reset_attachments)
         self.upload_csv_btn = QPushButton("Upload Destination Emails (CSV)")
         self.upload_csv_btn.clicked.connect(self.upload_csv)
-        self.dest_list = QListWidget()
+        self.dest_summary = QLabel("No destinations loaded")
+        self.dest_summary.setStyleSheet("font-size: 13px; font-weight: normal; color: #546e7a;")
+        self.dest_model = CompactListModel(parent=self)
+        self.dest_list = compact_list_view(self.dest_model)
+        self.dest_search = QLineEdit()
+        self.dest_search.setPlaceholderText("Search destinations")
+        self.dest_search.textChanged.connect(self.dest_model.set_filter)
         self.reset_dest_btn = QPushButton("Reset Destinations")
         self.reset_dest_btn.clicked.connect(self.reset_destinations)
         self.send_btn = QPushButton("Send Bulk Emails")
         self.send_btn.clicked.connect(self.send_bulk_emails)
+        self.concurrency_input = QSpinBox()
+        self.concurrency_input.setRange(1, 10)
+        self.concurrency_input.setValue(DEFAULT_CONCURRENCY)
+        self.concurrency_input.setPrefix("Parallel sends per sender: ")
+        self.batch_size_input = QSpinBox()
+        self.batch_size_input.setRange(1, MAX_BATCH_SIZE)
+        self.batch_size_input.setValue(1)
+        self.batch_size_input.setPrefix("Batch size: ")
+        self.batch_size_input.setSpecialValueText("Batch size: off")
+        self.memory_input = QSpinBox()
+        self.memory_input.setRange(1, 64)
+        self.memory_input.setValue(MAX_MESSAGE_MEMORY // (1024 * 1024))
+        self.memory_input.setPrefix("Memory per message: ")
+        self.memory_input.setSuffix(" MB")
+        send_options = QHBoxLayout()
+        send_options.addWidget(self.concurrency_input)
+        send_options.addWidget(self.batch_size_input)
+        send_options.addWidget(self.memory_input)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("%v / %m")
+        self.progress_label = QLabel("")
+        self.progress_label.setStyleSheet("font-size: 13px; font-weight: normal; color: #546e7a;")
+        self.stats_label = QLabel("")
+        self.stats_label.setStyleSheet("font-family: Consolas, monospace; font-size: 12px; font-weight: normal; color: #546e7a;")
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(STATS_INTERVAL_MS)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.failed_label = QLabel("Failed Emails")
+        self.failed_label.setStyleSheet("font-size: 13px; font-weight: normal; color: #546e7a;")
+        self.failed_model = CompactListModel(parent=self)
+        self.failed_list = compact_list_view(self.failed_model)
+        self.failed_list.setMaximumHeight(120)
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel_send)
+        self.resume_btn = QPushButton("Resume Campaign")
+        self.resume_btn.clicked.connect(self.resume_campaign)
+        send_controls = QHBoxLayout()
+        send_controls.addWidget(self.pause_btn)
+        send_controls.addWidget(self.cancel_btn)
+        send_controls.addWidget(self.resume_btn)
         self.logout_btn = QPushButton("Logout")
         self.logout_btn.clicked.connect(self.logout)
         # Add widgets to layout
@@ -74,9 +139,18 @@ class CustomerDashboard(QWidget):
         layout.addWidget(self.attach_list)
         layout.addWidget(self.reset_attach_btn)
         layout.addWidget(self.upload_csv_btn)
+        layout.addWidget(self.dest_summary)
+        layout.addWidget(self.dest_search)
         layout.addWidget(self.dest_list)
         layout.addWidget(self.reset_dest_btn)
+        layout.addLayout(send_options)
         layout.addWidget(self.send_btn)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.progress_label)
+        layout.addLayout(send_controls)
+        layout.addWidget(self.stats_label)
+        layout.addWidget(self.failed_label)
+        layout.addWidget(self.failed_list)
         layout.addWidget(self.logout_btn)
         self.setLayout(layout)
         self.attachments = []
@@ -102,7 +176,7 @@ class CustomerDashboard(QWidget):
             QPushButton:hover {
                 background: #1565c0;
             }
-            QLineEdit, QTextEdit, QListWidget {
+            QLineEdit, QTextEdit, QListView {
                 background: #fff;
                 border: 1px solid #cfd8dc;
                 border-radius: 4px;
@@ -121,24 +195,29 @@ class CustomerDashboard(QWidget):
         self.reset_body_btn.setStyleSheet(reset_btn_style)
         self.reset_attach_btn.setStyleSheet(reset_btn_style)
         self.reset_dest_btn.setStyleSheet(reset_btn_style)
+        self.pause_btn.setStyleSheet(reset_btn_style)
+        self.cancel_btn.setStyleSheet(reset_btn_style)
+        self.resume_btn.setStyleSheet(reset_btn_style)
+        self.set_sending(False)
         self.logout_btn.setStyleSheet("background: #e53935; color: white; border-radius: 6px; padding: 8px 16px; font-size: 14px;")
 
     def load_senders_from_tokens(self):
-        self.sender_emails = []
-        self.sender_list.clear()
-        for token_file in glob.glob(os.path.join(os.getcwd(), 'token_*.pickle')):
-            try:
-                import pickle
-                with open(token_file, 'rb') as f:
-                    creds = pickle.load(f)
-                from googleapiclient.discovery import build
-                service = build('gmail', 'v1', credentials=creds)
-                profile = service.users().getProfile(userId='me').execute()
-                email = profile.get('emailAddress', 'Unknown')
-                self.sender_emails.append({'email': email, 'creds': creds, 'token_path': token_file, 'limit': 500})
-                self.sender_list.addItem(email)
-            except Exception as e:
-                print(f"Failed to load sender from {token_file}: {e}")
+        self.sender_emails = load_senders(os.getcwd())
+        self.sender_model.clear()
+        self.sender_model.append_many(sender['email'] for sender in self.sender_emails)
+        # Profiles are re-checked in the background; the window does not wait for the network
+        if self.sender_emails:
+            self.profile_task = BackgroundTask(refresh_profiles, self.service_pool, list(self.sender_emails), parent=self)
+            self.profile_task.succeeded.connect(self.on_profiles_refreshed)
+            self.profile_task.start()
+
+    def on_profiles_refreshed(self, errors):
+        for sender, error in errors:
+            # Keep accounts verified on an earlier run; a failure may just mean no network
+            if not sender.get('verified') and sender in self.sender_emails:
+                self.sender_emails.remove(sender)
+        self.sender_model.clear()
+        self.sender_model.append_many(sender['email'] for sender in self.sender_emails)
 
     def add_sender(self):
         import traceback
@@ -153,15 +232,14 @@ class CustomerDashboard(QWidget):
             flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
             from googleapiclient.discovery import build
-            service = build('gmail', 'v1', credentials=creds)
-            profile = service.users().getProfile(userId='me').execute()
+            profile = build('gmail', 'v1', credentials=creds, cache_discovery=False).users().getProfile(userId='me').execute()
             email = profile.get('emailAddress', 'Unknown')
             token_path = os.path.join(os.getcwd(), f'token_{email}.pickle')
-            import pickle
-            with open(token_path, 'wb') as token:
-                pickle.dump(creds, token)
-            self.sender_emails.append({'email': email, 'creds': creds, 'token_path': token_path, 'limit': 500})
-            self.sender_list.addItem(email)
+            save_credentials(token_path, creds, email)
+            sender = {'email': email, 'creds': creds, 'token_path': token_path, 'limit': DEFAULT_LIMIT, 'verified': True}
+            self.service_pool.discard(sender)
+            self.sender_emails.append(sender)
+            self.sender_model.append(email)
             QMessageBox.information(self, "Success", f"Sender {email} added and token saved as {token_path}")
         except Exception as e:
             print("Error in add_sender:", e)
@@ -171,11 +249,31 @@ class CustomerDashboard(QWidget):
     def upload_csv(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Open CSV", "", "CSV Files (*.csv)")
         if file_path:
-            df = pd.read_csv(file_path)
-            emails = df.iloc[:,0].dropna().tolist()
-            self.dest_emails = emails
-            self.dest_list.clear()
-            self.dest_list.addItems(emails)
+            self.reset_destinations()
+            self.dest_summary.setText("Reading CSV...")
+            self.upload_csv_btn.setEnabled(False)
+            self.dest_store = CompactStringStore()
+            scan = self.metrics.timed('csv_scan', RecipientSource(file_path).scan)
+            self.csv_task = BackgroundTask(scan, self.dest_store.append, should_continue=self.alive.is_set, parent=self)
+            self.csv_task.succeeded.connect(self.on_csv_loaded)
+            self.csv_task.failed.connect(self.on_csv_failed)
+            self.csv_task.start()
+
+    def on_csv_loaded(self, source):
+        self.upload_csv_btn.setEnabled(True)
+        self.recipient_source = source
+        self.dest_model.set_store(self.dest_store)
+        self.dest_store = None
+        summary = f"{source.unique:,} unique destinations ({source.duplicates:,} duplicates skipped)"
+        names = sorted(field_index(source.columns))
+        if len(source.columns) > 1:
+            summary += "\nPersonalize with: " + ", ".join(f"{{{name}}}" for name in names)
+        self.dest_summary.setText(summary)
+
+    def on_csv_failed(self, error):
+        self.upload_csv_btn.setEnabled(True)
+        self.dest_summary.setText("No destinations loaded")
+        QMessageBox.critical(self, "Error", f"Failed to read CSV: {error}")
 
     def add_attachments(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Select Attachments")
@@ -184,69 +282,196 @@ class CustomerDashboard(QWidget):
             self.attach_list.addItems(files)
 
     def send_bulk_emails(self):
+        if self.send_worker and self.send_worker.isRunning():
+            return
         if not self.sender_emails:
             QMessageBox.warning(self, "Error", "Add at least one Gmail sender account.")
             return
-        if not self.dest_emails:
+        if not self.recipient_source or not len(self.recipient_source):
             QMessageBox.warning(self, "Error", "Upload a CSV with destination emails.")
             return
         subject = self.subject_input.text().strip()
         body = self.body_input.toHtml()
-        attachments = getattr(self, 'attachments', [])
-        failed = []
-        sender_idx = 0
-        sender_limits = [500 for _ in self.sender_emails]
-        for dest in self.dest_emails:
-            try:
-                validate_email(dest)
-            except EmailNotValidError:
-                failed.append(dest)
-                continue
-            # Find next sender with quota
-            while sender_idx < len(self.sender_emails) and sender_limits[sender_idx] <= 0:
-                sender_idx += 1
-            if sender_idx >= len(self.sender_emails):
-                failed.append(dest)
-                continue
-            sender = self.sender_emails[sender_idx]
-            try:
-                service = build('gmail', 'v1', credentials=sender['creds'])
-                message = self.create_message(sender['email'], dest, subject, body, attachments)
-                service.users().messages().send(userId='me', body=message).execute()
-                sender_limits[sender_idx] -= 1
-            except Exception as e:
-                failed.append(dest)
-                if 'limit' in str(e).lower():
-                    sender_limits[sender_idx] = 0
+        attachments = list(getattr(self, 'attachments', []))
+        unknown = MailMerge(subject, body, self.recipient_source.columns).unknown
+        if unknown:
+            placeholders = ", ".join(f"{{{name}}}" for name in unknown)
+            reply = QMessageBox.question(self, "Unknown Placeholders",
+                                         f"No CSV column matches {placeholders}. They will be sent as written. Send anyway?")
+            if reply != QMessageBox.Yes:
+                return
+        journal = None
+        if self.db is not None:
+            journal = CampaignJournal.new(self.db, self.user_email, subject, body, attachments, self.recipient_source.path)
+        self.start_campaign(self.recipient_source, subject, body, attachments, journal)
+
+    def start_campaign(self, source, subject, body, attachments, journal):
+        self.progress_bar.setRange(0, len(source))
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("Validating recipients...")
+        self.failed_emails = []
+        self.failed_model.clear()
+        self.send_worker = SendWorker(list(self.sender_emails), source, subject, body, attachments,
+                                      concurrency=self.concurrency_input.value(),
+                                      service_pool=self.service_pool, batch_size=self.batch_size_input.value(),
+                                      journal=journal, quota=self.quota,
+                                      max_message_memory=self.memory_input.value() * 1024 * 1024,
+                                      metrics=self.metrics, parent=self)
+        self.send_worker.progress.connect(self.on_send_progress)
+        self.send_worker.throughput.connect(self.on_send_throughput)
+        self.send_worker.validated.connect(self.on_recipients_validated)
+        self.send_worker.completed.connect(self.on_send_completed)
+        self.send_worker.crashed.connect(self.on_send_crashed)
+        self.set_sending(True)
+        self.send_worker.start()
+
+    def resume_campaign(self):
+        if self.send_worker and self.send_worker.isRunning():
+            return
+        if self.db is None:
+            QMessageBox.warning(self, "Error", "No database connection.")
+            return
+        if not self.sender_emails:
+            QMessageBox.warning(self, "Error", "Add at least one Gmail sender account.")
+            return
+        db, owner = self.db, self.user_email
+        self.executor.submit('resumable', lambda: CampaignJournal.resumable(db, owner), self.on_resumable_loaded,
+                             self.on_db_error, busy=self.resume_btn)
+
+    def on_resumable_loaded(self, campaigns):
+        if self.send_worker and self.send_worker.isRunning():
+            return
+        if not campaigns:
+            QMessageBox.information(self, "Resume", "There are no interrupted campaigns.")
+            return
+        labels = [f"{c.get('subject') or '(no subject)'} - {c.get('sent', 0)} sent - {c['created_at']:%Y-%m-%d %H:%M}" for c in campaigns]
+        label, ok = QInputDialog.getItem(self, "Resume Campaign", "Campaign:", labels, 0, False)
+        if not ok:
+            return
+        campaign = campaigns[labels.index(label)]
+        if not os.path.exists(campaign['source_path']):
+            QMessageBox.critical(self, "Error", f"Recipient file not found: {campaign['source_path']}")
+            return
+        missing = [f for f in campaign['attachments'] if not os.path.exists(f)]
+        if missing:
+            QMessageBox.critical(self, "Error", f"Attachments not found: {', '.join(missing)}")
+            return
+        self.subject_input.setText(campaign['subject'])
+        self.body_input.setHtml(campaign['body'])
+        self.reset_attachments()
+        self.attachments.extend(campaign['attachments'])
+        self.attach_list.addItems(campaign['attachments'])
+        source = RecipientSource(campaign['source_path'])
+        self.start_campaign(source, campaign['subject'], campaign['body'], campaign['attachments'],
+                            CampaignJournal(self.db, campaign))
+
+    def on_db_error(self, error):
+        QMessageBox.critical(self, "Error", f"Database error: {error}")
+
+    def on_send_progress(self, done, total, dest):
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        self.last_dest = dest
+
+    def on_recipients_validated(self, valid, invalid, duplicates):
+        self.progress_bar.setMaximum(valid + invalid)
+        self.dest_summary.setText(f"{valid:,} valid, {invalid:,} invalid, {duplicates:,} duplicate destinations")
+
+    def on_send_throughput(self, rate):
+        self.progress_label.setText(f"{rate:.1f} emails/sec - last: {getattr(self, 'last_dest', '')}")
+
+    def on_send_completed(self, failed, cancelled):
+        self.set_sending(False)
+        self.send_worker = None
+        self.failed_emails = failed
+        self.failed_model.append_many(failed)
         if failed:
             failed_path = os.path.join(os.getcwd(), "failed_emails.csv")
-            pd.DataFrame(failed).to_csv(failed_path, index=False, header=False)
+            with open(failed_path, 'w', newline='') as f:
+                csv.writer(f).writerows([address] for address in failed)
+        if cancelled:
+            self.progress_label.setText("Cancelled.")
+            msg = "Sending cancelled."
+            if failed:
+                msg += f" Failed emails so far saved to {failed_path}"
+            QMessageBox.information(self, "Cancelled", msg)
+        elif failed:
+            self.progress_label.setText(f"Done with {len(failed)} failures.")
             QMessageBox.warning(self, "Failed", f"Some emails failed. See {failed_path}")
         else:
+            self.progress_label.setText("Done.")
             QMessageBox.information(self, "Success", "All emails sent!")
 
-    def create_message(self, sender, to, subject, body, attachments):
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.text import MIMEText
-        from email.mime.base import MIMEBase
-        from email import encoders
-        import base64
-        message = MIMEMultipart()
-        message['to'] = to
-        message['from'] = sender
-        message['subject'] = subject
-        message.attach(MIMEText(body, 'html'))
-        for file in attachments:
-            with open(file, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename="{os.path.basename(file)}"')
-                message.attach(part)
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        return {'raw': raw}
+    def on_send_crashed(self, error):
+        self.set_sending(False)
+        self.send_worker = None
+        self.progress_label.setText("Interrupted.")
+        QMessageBox.critical(self, "Error", f"Sending stopped: {error}. You can resume the campaign later.")
+
+    def update_stats(self):
+        snapshot = self.metrics.snapshot()
+        if not snapshot['senders'] and not snapshot['stages']:
+            self.stats_label.setText("")
+            return
+        lines = [f"{snapshot['sent']:,} sent, {snapshot['rate']:.1f}/sec, {snapshot['error_rate']:.1%} errors"]
+        for sender, stats in sorted(snapshot['senders'].items()):
+            lines.append(f"  {sender}: {stats['sent']:,} sent, {stats['rate']:.2f}/sec, {stats['failed']:,} failed")
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f"  {stage}: p50 {stats['p50'] * 1000:.0f} ms, p95 {stats['p95'] * 1000:.0f} ms, "
+                         f"max {stats['max'] * 1000:.0f} ms ({stats['count']:,})")
+        if snapshot['error_types']:
+            lines.append("  errors: " + ", ".join(f"{kind} x{n}" for kind, n in sorted(snapshot['error_types'].items())))
+        if snapshot['retries']:
+            lines.append("  retries: " + ", ".join(f"{kind} x{n}" for kind, n in sorted(snapshot['retries'].items())))
+        self.stats_label.setText("\n".join(lines))
+
+    def toggle_pause(self):
+        if not self.send_worker:
+            return
+        if self.send_worker.engine.paused:
+            self.send_worker.resume()
+            self.pause_btn.setText("Pause")
+        else:
+            self.send_worker.pause()
+            self.pause_btn.setText("Resume")
+            self.progress_label.setText("Paused.")
+
+    def cancel_send(self):
+        if self.send_worker:
+            self.send_worker.cancel()
+            self.progress_label.setText("Cancelling...")
+
+    def set_sending(self, sending):
+        self.send_btn.setEnabled(not sending)
+        self.resume_btn.setEnabled(not sending)
+        self.concurrency_input.setEnabled(not sending)
+        self.batch_size_input.setEnabled(not sending)
+        self.memory_input.setEnabled(not sending)
+        self.pause_btn.setEnabled(sending)
+        self.cancel_btn.setEnabled(sending)
+        self.pause_btn.setText("Pause")
+        if sending:
+            self.stats_timer.start()
+        else:
+            self.stats_timer.stop()
+            self.update_stats()
+
+    def stop_sending(self):
+        # Runs on logout and close, so nothing here waits: a send is cancelled
+        # and finishes in the background (its journal still records it as
+        # cancelled), a CSV scan stops at its next chunk.
+        self.alive.clear()
+        if self.send_worker and self.send_worker.isRunning():
+            self.send_worker.cancel()
+        for task in (self.send_worker, self.csv_task, self.profile_task):
+            if task and task.isRunning():
+                detach(task)
+        self.send_worker = None
+        self.csv_task = None
+        self.profile_task = None
 
     def logout(self):
+        self.stop_sending()
         from session import clear_session
         clear_session()
         QMessageBox.information(self, "Logged Out", "You have been logged out.")
@@ -259,22 +484,24 @@ class CustomerDashboard(QWidget):
         self.body_input.clear()
         self.attachments = []
         self.attach_list.clear()
-        self.dest_emails = []
-        self.dest_list.clear()
+        self.recipient_source = None
+        self.dest_model.clear()
+        self.dest_summary.setText("No destinations loaded")
         self.sender_emails = []
-        self.sender_list.clear()
+        self.sender_model.clear()
 
     def reset_senders(self):
         self.sender_emails = []
-        self.sender_list.clear()
+        self.sender_model.clear()
 
     def reset_attachments(self):
         self.attachments = []
         self.attach_list.clear()
 
     def reset_destinations(self):
-        self.dest_emails = []
-        self.dest_list.clear()
+        self.recipient_source = None
+        self.dest_model.clear()
+        self.dest_summary.setText("No destinations loaded")
 
     def center(self):
         # Center the window on the screen
@@ -283,6 +510,10 @@ class CustomerDashboard(QWidget):
         qr.moveCenter(cp)
         self.move(qr.topLeft())
 
+    def closeEvent(self, event):
+        self.stop_sending()
+        super().closeEvent(event)
+
     def showEvent(self, event):
         super().showEvent(event)
         self.center()
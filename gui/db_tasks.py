@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+
+MAX_WORKERS = 4
+
+_pool = None
+
+
+def _shared_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="db")
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+class DbExecutor(QObject):
+    # Runs blocking pymongo calls on a shared thread pool and hands results
+    # back on the GUI thread. Parent it to the window that uses it: if the
+    # window is deleted first, late results are simply dropped.
+    _finished = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._running = {}
+        self._busy = {}
+        self._finished.connect(self._on_finished, Qt.QueuedConnection)
+
+    def is_running(self, key):
+        return key in self._running
+
+    def submit(self, key, fn, on_success, on_error=None, busy=None):
+        # At most one call per key; returns False if one is already in flight
+        if key in self._running:
+            return False
+        busy = [busy] if busy is not None and not isinstance(busy, (list, tuple)) else list(busy or [])
+        for widget in busy:
+            # Widgets can be shared by several keys; only the first call changes them
+            state = self._busy.setdefault(widget, [0, widget.text()])
+            if not state[0]:
+                widget.setEnabled(False)
+                widget.setText(f"{state[1]}...")
+            state[0] += 1
+        self._running[key] = (on_success, on_error, busy)
+        future = _shared_pool().submit(fn)
+        future.add_done_callback(lambda f: self._finished.emit(key, f))
+        return True
+
+    def _on_finished(self, key, future):
+        on_success, on_error, busy = self._running.pop(key)
+        for widget in busy:
+            state = self._busy[widget]
+            state[0] -= 1
+            if not state[0]:
+                del self._busy[widget]
+                widget.setText(state[1])
+                widget.setEnabled(True)
+        error = future.exception()
+        if error is None:
+            on_success(future.result())
+        elif on_error:
+            on_error(error)
@@ -0,0 +1,65 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtWidgets import QListView
+from mailer.recipients import CompactStringStore
+
+
+class CompactListModel(QAbstractListModel):
+    def __init__(self, store=None, parent=None):
+        super().__init__(parent)
+        self.store = store if store is not None else CompactStringStore()
+        self._rows = None
+        self._filter = ''
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows) if self._rows is not None else len(self.store)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self._rows[index.row()] if self._rows is not None else index.row()
+        return self.store[row]
+
+    def set_store(self, store):
+        self.beginResetModel()
+        self.store = store
+        self._rows = self.store.find_rows(self._filter) if self._filter else None
+        self.endResetModel()
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        self._filter = text.strip()
+        self._rows = self.store.find_rows(self._filter) if self._filter else None
+        self.endResetModel()
+
+    def append(self, item):
+        self.append_many([item])
+
+    def append_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        if self._filter:
+            self.store.extend(items)
+            self.set_filter(self._filter)
+            return
+        first = len(self.store)
+        self.beginInsertRows(QModelIndex(), first, first + len(items) - 1)
+        self.store.extend(items)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.store = CompactStringStore()
+        self._rows = None
+        self.endResetModel()
+
+
+def compact_list_view(model):
+    view = QListView()
+    view.setModel(model)
+    # Uniform sizes let the view skip measuring every row, so only visible rows are ever rendered
+    view.setUniformItemSizes(True)
+    view.setLayoutMode(QListView.Batched)
+    return view
@@ -1,16 +1,19 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QMessageBox
 from PyQt5.QtCore import Qt
-from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from gui.db_tasks import DbExecutor
+from db import USER_SESSION_FIELDS
+from session import is_allowed
 
 class LoginWindow(QWidget):
-    def __init__(self, mongo_uri):
+    def __init__(self, database):
         super().__init__()
         self.setWindowTitle("Bulk Email Sender - Login")
         self.setGeometry(100, 100, 400, 250)
-        self.mongo_uri = mongo_uri
-        self.client = MongoClient(self.mongo_uri) if self.mongo_uri else None
-        self.db = self.client['bulk_email_app'] if self.client else None
+        self.database = database
+        self.db = self.database.db if self.database else None
         self.logout_success = None
+        self.executor = DbExecutor(parent=self)
         self.init_ui()
         self.center()
 
@@ -60,11 +63,19 @@ class LoginWindow(QWidget):
         if not username or not password:
             QMessageBox.warning(self, "Error", "Please enter both username and password.")
             return
-        user = self.db.users.find_one({"username": username, "password": password})
+        self.executor.submit(
+            'login',
+            lambda: self.db.users.find_one({"username": username, "password": password}, USER_SESSION_FIELDS),
+            self.on_login_result,
+            self.on_db_error,
+            busy=[self.login_btn, self.register_btn],
+        )
+
+    def on_login_result(self, user):
         if not user:
             QMessageBox.warning(self, "Error", "Invalid credentials.")
             return
-        if user['role'] == 'customer' and not user.get('active', False):
+        if not is_allowed(user):
             QMessageBox.information(self, "Inactive", "Your account is not active. Please wait for admin approval.")
             return
         # Open admin or customer dashboard via callback
@@ -79,17 +90,33 @@ class LoginWindow(QWidget):
         if not username or not password:
             QMessageBox.warning(self, "Error", "Please enter both username and password.")
             return
-        if self.db.users.find_one({"username": username}):
+
+        def register_user():
+            if self.db.users.find_one({"username": username}, {"_id": 1}):
+                return False
+            try:
+                self.db.users.insert_one({
+                    "username": username,
+                    "password": password,
+                    "role": "customer",
+                    "active": False
+                })
+            except DuplicateKeyError:
+                return False
+            return True
+
+        self.executor.submit('register', register_user, self.on_register_result, self.on_db_error,
+                             busy=[self.login_btn, self.register_btn])
+
+    def on_register_result(self, registered):
+        if not registered:
             QMessageBox.warning(self, "Error", "Username already registered.")
             return
-        self.db.users.insert_one({
-            "username": username,
-            "password": password,
-            "role": "customer",
-            "active": False
-        })
         QMessageBox.information(self, "Registered", "Registration successful! Wait for admin activation.")
 
+    def on_db_error(self, error):
+        QMessageBox.critical(self, "Error", f"Database error: {error}")
+
     def logout(self):
         from session import clear_session
         clear_session()
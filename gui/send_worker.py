@@ -0,0 +1,46 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+from mailer.engine import SendEngine
+from mailer.dispatcher import DEFAULT_CONCURRENCY
+from mailer.message import MAX_MESSAGE_MEMORY
+
+
+class SendWorker(QThread):
+    progress = pyqtSignal(int, int, str)
+    throughput = pyqtSignal(float)
+    validated = pyqtSignal(int, int, int)
+    completed = pyqtSignal(list, bool)
+    crashed = pyqtSignal(str)
+
+    def __init__(self, senders, recipients, subject, body, attachments, concurrency=DEFAULT_CONCURRENCY,
+                 service_pool=None, batch_size=0, journal=None, quota=None,
+                 max_message_memory=MAX_MESSAGE_MEMORY, metrics=None, parent=None):
+        super().__init__(parent)
+        self.engine = SendEngine(senders, recipients, subject, body, attachments,
+                                 on_progress=self._on_progress, concurrency=concurrency,
+                                 service_pool=service_pool, batch_size=batch_size,
+                                 on_validated=self._on_validated, journal=journal, quota=quota,
+                                 max_message_memory=max_message_memory, metrics=metrics)
+
+    def _on_progress(self, done, total, rate, dest):
+        self.progress.emit(done, total, dest)
+        self.throughput.emit(rate)
+
+    def _on_validated(self, summary):
+        self.validated.emit(summary.valid, summary.invalid, summary.duplicates)
+
+    def run(self):
+        try:
+            failed = self.engine.run()
+        except Exception as e:
+            self.crashed.emit(str(e))
+            return
+        self.completed.emit(failed, self.engine.cancelled)
+
+    def pause(self):
+        self.engine.pause()
+
+    def resume(self):
+        self.engine.resume()
+
+    def cancel(self):
+        self.engine.cancel()
@@ -0,0 +1,218 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_CONCURRENCY = 2
+# Gmail rejects batches with more than 100 calls
+MAX_BATCH_SIZE = 100
+# Sends an account reserves from the shared quota at a time
+QUOTA_BLOCK = 10
+
+
+class QuotaExhausted(Exception):
+    # `until`: when Gmail said the account can send again (UTC), if it said
+    def __init__(self, message='', until=None):
+        super().__init__(message)
+        self.until = until
+
+
+class SenderSlot:
+    # One account's share of a campaign. Without a QuotaManager it may send
+    # `limit` messages; with one, sends are reserved from the account's shared
+    # rolling window QUOTA_BLOCK at a time, and whatever is left when the
+    # campaign stops goes back to the window (see close()).
+    def __init__(self, sender, quota=None):
+        self.sender = sender
+        self.quota = quota
+        self.remaining = sender['limit'] if quota is None else 0
+        self.sent = 0
+        self._hour = None
+        self._lock = threading.Lock()
+
+    @property
+    def email(self):
+        return self.sender['email']
+
+    def reserve(self):
+        with self._lock:
+            if self.remaining == 0 and self.quota is not None:
+                self.remaining, self._hour = self.quota.reserve(self.sender, QUOTA_BLOCK)
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def release(self):
+        with self._lock:
+            if self.remaining >= 0:
+                self.remaining += 1
+
+    def commit(self):
+        with self._lock:
+            self.sent += 1
+
+    def exhaust(self):
+        with self._lock:
+            unused, self.remaining = self.remaining, -1
+        self._give_back(unused)
+
+    def close(self):
+        with self._lock:
+            unused, self.remaining = self.remaining, min(self.remaining, 0)
+        self._give_back(unused)
+
+    def _give_back(self, unused):
+        if self.quota is not None and unused > 0:
+            self.quota.release(self.email, unused, self._hour)
+
+    @property
+    def exhausted(self):
+        return self.remaining < 0
+
+
+class Dispatcher:
+    # Every sender account gets its own pool of `concurrency` workers. Workers
+    # pull from one shared recipient iterator and only claim a recipient after
+    # reserving a unit of their account's quota, so accounts with more quota
+    # left take proportionally more of the list and no account passes `limit`,
+    # not even across campaigns and processes sharing a QuotaManager.
+    # A recipient whose account hits its quota mid-send goes back on a shared
+    # queue for the other accounts instead of failing; workers only stop
+    # once no recipient is left in flight that could still come back.
+    def __init__(self, senders, send_fn, concurrency=DEFAULT_CONCURRENCY, should_continue=None, on_result=None,
+                 send_batch_fn=None, batch_size=0, quota=None):
+        self.quota = quota
+        # With a QuotaManager each send comes out of the shared rolling 24h window, not `limit`
+        self.slots = [SenderSlot(sender, quota) for sender in senders]
+        self.send_fn = send_fn
+        self.send_batch_fn = send_batch_fn
+        self.batch_size = min(max(0, int(batch_size)), MAX_BATCH_SIZE)
+        self.concurrency = max(1, int(concurrency))
+        self.should_continue = should_continue or (lambda: True)
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._recipients = None
+        self._requeued = deque()
+        self._in_flight = 0
+
+    def _next(self, block=True):
+        with self._cond:
+            while True:
+                if self._requeued:
+                    dest = self._requeued.popleft()
+                else:
+                    dest = next(self._recipients, None)
+                if dest is not None:
+                    self._in_flight += 1
+                    return dest
+                if not block or not self._in_flight:
+                    return None
+                self._cond.wait()
+
+    def _finished(self, dest, requeue=False):
+        with self._cond:
+            self._in_flight -= 1
+            if requeue:
+                self._requeued.append(dest)
+            self._cond.notify_all()
+
+    def _report(self, slot, dest, error):
+        if self.on_result:
+            self.on_result(slot.email if slot else None, dest, error)
+
+    def _settle(self, slot, dest, error):
+        # Returns False once the account has hit its quota
+        if error is None:
+            slot.commit()
+            self._finished(dest)
+            self._report(slot, dest, None)
+            return True
+        if isinstance(error, QuotaExhausted):
+            if not slot.exhausted:
+                slot.exhaust()
+                if self.quota:
+                    self.quota.block(slot.email, until=error.until)
+            self._finished(dest, requeue=True)
+            return False
+        slot.release()
+        self._finished(dest)
+        self._report(slot, dest, error)
+        return True
+
+    def _worker(self, slot):
+        while self.should_continue():
+            if not slot.reserve():
+                return
+            if self.quota and not self.quota.acquire(slot.email, should_continue=self.should_continue):
+                slot.release()
+                return
+            dest = self._next()
+            if dest is None:
+                slot.release()
+                return
+            if slot.exhausted:
+                # Another worker of this account hit the quota while we waited
+                self._finished(dest, requeue=True)
+                return
+            try:
+                self.send_fn(slot.sender, dest)
+            except Exception as e:
+                if not self._settle(slot, dest, e):
+                    return
+                continue
+            self._settle(slot, dest, None)
+
+    def _batch_worker(self, slot):
+        while self.should_continue():
+            dests = []
+            while len(dests) < self.batch_size and slot.reserve():
+                # Only wait for requeued recipients while holding none, or two batch workers could wait on each other
+                dest = self._next(block=not dests)
+                if dest is None:
+                    slot.release()
+                    break
+                dests.append(dest)
+            if not dests:
+                return
+            if self.quota and not self.quota.acquire(slot.email, len(dests), should_continue=self.should_continue):
+                # Cancelled while waiting for the rate limiter; nothing was sent
+                for dest in dests:
+                    slot.release()
+                    self._finished(dest)
+                    self._report(slot, dest, RuntimeError("Cancelled before sending"))
+                return
+            try:
+                results = self.send_batch_fn(slot.sender, dests)
+            except Exception as e:
+                results = [(dest, e) for dest in dests]
+            exhausted = False
+            for dest, error in results:
+                if not self._settle(slot, dest, error):
+                    exhausted = True
+            if exhausted:
+                return
+
+    def run(self, recipients):
+        self._recipients = iter(recipients)
+        pools = [ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"send-{slot.email}") for slot in self.slots]
+        try:
+            futures = []
+            worker = self._batch_worker if self.send_batch_fn and self.batch_size > 1 else self._worker
+            for pool, slot in zip(pools, self.slots):
+                futures.extend(pool.submit(worker, slot) for _ in range(self.concurrency))
+            wait(futures)
+            for future in futures:
+                future.result()
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=True)
+            for slot in self.slots:
+                slot.close()
+        # Whatever is left once every account is out of quota cannot be sent
+        if self.should_continue():
+            leftover = list(self._requeued)
+            self._requeued.clear()
+            for dest in leftover:
+                self._report(None, dest, QuotaExhausted("All sender accounts have reached their limit"))
+            for dest in self._recipients:
+                self._report(None, dest, QuotaExhausted("All sender accounts have reached their limit"))
@@ -0,0 +1,307 @@
+import threading
+import time
+import logging
+from array import array
+from itertools import islice
+from operator import itemgetter
+from mailer.message import MessageTemplate, MAX_MESSAGE_MEMORY
+from mailer.gmail_service import ServicePool
+from mailer.recipients import CompactStringStore, address_key
+from mailer.validation import RecipientValidator, ValidationSummary
+from mailer.dispatcher import Dispatcher, DEFAULT_CONCURRENCY
+from mailer.templating import MailMerge
+from mailer.metrics import Metrics
+from mailer.retry import RetryPolicy, classify, quota_exhausted, QUOTA, TRANSIENT
+
+logger = logging.getLogger(__name__)
+
+# Joins a row's merge fields into one CompactStringStore entry
+FIELD_SEPARATOR = '\x1f'
+# Rows checked against the journal per lookup when resuming
+LOOKUP_SIZE = 1000
+
+
+class SendEngine:
+    # Qt-free campaign runner; the GUI drives it from a QThread (see gui/send_worker.py)
+    def __init__(self, senders, recipients, subject, body, attachments, on_progress=None, concurrency=DEFAULT_CONCURRENCY,
+                 service_pool=None, batch_size=0, validator=None, on_validated=None, journal=None,
+                 quota=None, max_message_memory=MAX_MESSAGE_MEMORY, metrics=None, retry=None):
+        self.senders = senders
+        self.recipients = recipients
+        self.subject = subject
+        self.body = body
+        self.attachments = attachments
+        self.on_progress = on_progress
+        self.concurrency = concurrency
+        self.service_pool = service_pool or ServicePool()
+        self.batch_size = batch_size
+        self.validator = validator or RecipientValidator()
+        self.on_validated = on_validated
+        self.summary = ValidationSummary()
+        self.journal = journal
+        self.quota = quota
+        self.max_message_memory = max_message_memory
+        self.metrics = metrics or Metrics()
+        self.retry = retry or RetryPolicy()
+        self.skipped = 0
+        self._total = len(recipients)
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _wait_if_paused(self):
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+    def _on_result(self, sender_email, row, error):
+        # Recipients travel through the dispatcher as rows, address first
+        dest = row[0]
+        with self._lock:
+            self._done += 1
+            if error is None:
+                self._sent += 1
+            else:
+                self._failed.append(dest)
+            done, sent = self._done, self._sent
+        self.metrics.result(sender_email, error)
+        if self.journal:
+            self.journal.record(dest, 'sent' if error is None else 'failed', sender=sender_email, error=error)
+            self._advance(dest)
+        if error is not None and sender_email:
+            logger.warning("Send to %s via %s failed: %s", dest, sender_email, error)
+        if self.on_progress:
+            elapsed = time.monotonic() - self._started
+            rate = sent / elapsed if elapsed > 0 else 0.0
+            self.on_progress(done, self._total, rate, dest)
+
+    def _on_retry(self, sender, row, error, attempt):
+        self.metrics.retried(error)
+        logger.info("Retrying %s via %s (attempt %d): %s", row[0], sender['email'], attempt + 1, error)
+
+    def _send_one(self, sender, row):
+        def attempt():
+            service = self.service_pool.service(sender)
+            with self.metrics.timer('render'):
+                request = self.template.request(service.users().messages(), sender['email'], row[0], row)
+            with self.metrics.timer('send'):
+                self.service_pool.execute(sender, request)
+
+        try:
+            self.retry.call(attempt, should_continue=self._wait_if_paused,
+                            on_retry=lambda error, n: self._on_retry(sender, row, error, n))
+        except Exception as e:
+            if getattr(e, 'retry_class', None) == QUOTA:
+                raise quota_exhausted(e) from e
+            raise
+
+    def _execute_batch(self, sender, rows):
+        # Returns one error (or None) per row; a failed batch call fails every row
+        errors = [None] * len(rows)
+        try:
+            service = self.service_pool.service(sender)
+
+            def callback(request_id, response, exception):
+                errors[int(request_id)] = exception
+
+            batch = service.new_batch_http_request(callback=callback)
+            for i, row in enumerate(rows):
+                with self.metrics.timer('render'):
+                    message = self.template.render(sender['email'], row[0], row)
+                batch.add(service.users().messages().send(userId='me', body=message), request_id=str(i))
+            with self.metrics.timer('send_batch'):
+                self.service_pool.execute(sender, batch)
+        except Exception as e:
+            return [e] * len(rows)
+        return errors
+
+    def _send_batch(self, sender, rows):
+        # Same retry rules as _send_one, but only the rows that failed transiently are re-sent
+        results = [None] * len(rows)
+        pending = list(range(len(rows)))
+        attempt = 0
+        while True:
+            errors = self._execute_batch(sender, [rows[i] for i in pending])
+            attempt += 1
+            retry = []
+            for i, error in zip(pending, errors):
+                results[i] = error
+                if error is None:
+                    continue
+                kind = classify(error)
+                if kind == QUOTA:
+                    results[i] = quota_exhausted(error)
+                elif kind == TRANSIENT and attempt < self.retry.attempts:
+                    retry.append(i)
+            if not retry:
+                break
+            for i in retry:
+                self._on_retry(sender, rows[i], results[i], attempt)
+            if not self.retry.sleep(self.retry.delay(attempt - 1, results[retry[0]]), self._wait_if_paused):
+                break
+            pending = retry
+        return list(zip(rows, results))
+
+    def _validate(self, with_fields=False):
+        # Pre-pass: only clean, de-duplicated addresses reach the send loop.
+        # With merge fields, the rest of each row is kept in a parallel store.
+        # A resumed campaign starts at the journal's resume row; rows past it
+        # that were already sent are dropped before validation, so they cost
+        # no DNS lookups.
+        clean = CompactStringStore()
+        fields = CompactStringStore() if with_fields else None
+        self.summary = ValidationSummary()
+        self.skipped = 0
+        validated_skips = 0
+        start = self.journal.resume_row if self.journal else 0
+        resuming = bool(self.journal and self.journal.campaign.get('sent'))
+        self._end_row = start
+        address_of = (lambda pair: pair[1][0]) if with_fields else itemgetter(1)
+        source = self._numbered(start, with_fields)
+        if resuming:
+            source = self._undelivered(source, address_of)
+        for (row, item), normalized, error in self.validator.validate_all(source, self.summary,
+                                                                          should_continue=self._wait_if_paused,
+                                                                          key=address_of):
+            self._end_row = row + 1
+            address = item[0] if with_fields else item
+            if error is None:
+                # Normalizing can turn an address into one that was already sent
+                key = address_key(normalized)
+                if resuming and key != address_key(address) and self.journal.delivered([key]):
+                    self.skipped += 1
+                    validated_skips += 1
+                    continue
+                clean.append(normalized)
+                self._lines.append(row)
+                if fields is not None:
+                    fields.append(FIELD_SEPARATOR.join(value.replace(FIELD_SEPARATOR, ' ') for value in item[1:]))
+            else:
+                with self._lock:
+                    self._done += 1
+                    self._failed.append(address)
+                if self.journal:
+                    self.journal.record(address, 'invalid', error=error)
+        self._total = self.summary.valid + self.summary.invalid - validated_skips
+        if self.on_validated:
+            self.on_validated(self.summary)
+        return clean, fields
+
+    def _numbered(self, start, with_fields):
+        # (source row, item) pairs; plain lists are numbered here
+        numbered = getattr(self.recipients, 'numbered', None)
+        if numbered is not None:
+            return numbered(start, with_fields)
+        return islice(enumerate(self.recipients), start, None)
+
+    def _undelivered(self, source, address_of):
+        while True:
+            block = list(islice(source, LOOKUP_SIZE))
+            if not block:
+                return
+            keys = [address_key(address_of(pair)) for pair in block]
+            delivered = self.journal.delivered(keys)
+            for pair, key in zip(block, keys):
+                if key in delivered:
+                    self.skipped += 1
+                    continue
+                yield pair
+
+    def _rows(self, clean, fields):
+        for i, address in enumerate(clean):
+            with self._lock:
+                self._positions[address] = i
+            if fields is None:
+                yield (address,)
+            else:
+                yield (address,) + tuple(fields[i].split(FIELD_SEPARATOR))
+
+    def _advance(self, address):
+        # Moves the journal's resume row up to the first clean row still
+        # without a result; results arrive out of order
+        with self._lock:
+            i = self._positions.pop(address, None)
+            if i is None:
+                return
+            self._settled.add(i)
+            while self._low in self._settled:
+                self._settled.remove(self._low)
+                self._low += 1
+            row = self._lines[self._low] if self._low < len(self._lines) else self._end_row
+        self.journal.advance(row)
+
+    def run(self):
+        self._done = 0
+        self._sent = 0
+        self._failed = []
+        # Source row of each clean recipient, and which have a result, for _advance()
+        self._lines = array('Q')
+        self._positions = {}
+        self._settled = set()
+        self._low = 0
+        self._started = time.monotonic()
+        self.metrics.start_campaign()
+        if self.journal:
+            self.journal.on_lost = self.cancel
+            self.journal.open()
+        try:
+            self._run()
+        except Exception:
+            # Leave the campaign marked as running so it can be resumed
+            if self.journal:
+                self.journal.abandon()
+            raise
+        finally:
+            self._export_metrics()
+        if self.journal:
+            self.journal.finish(cancelled=self.cancelled)
+        return list(self._failed)
+
+    def _export_metrics(self):
+        try:
+            self.metrics.export()
+        except OSError as e:
+            logger.warning("Could not export metrics: %s", e)
+
+    def _run(self):
+        columns = getattr(self.recipients, 'columns', None) or ()
+        merge = MailMerge(self.subject, self.body, columns)
+        if merge.unknown:
+            logger.warning("Placeholders with no matching CSV column are sent as-is: %s", ', '.join(merge.unknown))
+        with self.metrics.timer('validate'):
+            clean, fields = self._validate(with_fields=merge.personalized and len(columns) > 1)
+        if self.cancelled:
+            return
+        with self.metrics.timer('template_build'):
+            self.template = MessageTemplate(self.subject, self.body, self.attachments,
+                                            max_message_memory=self.max_message_memory, merge=merge)
+        batch_size = self.batch_size
+        if self.template.streamed and batch_size > 1:
+            # Batch requests cannot carry media uploads
+            logger.info("Message is %d bytes, sending one by one instead of in batches", self.template.size)
+            batch_size = 0
+        dispatcher = Dispatcher(self.senders, self._send_one, concurrency=self.concurrency,
+                                should_continue=self._wait_if_paused, on_result=self._on_result,
+                                send_batch_fn=self._send_batch, batch_size=batch_size, quota=self.quota)
+        try:
+            dispatcher.run(self._rows(clean, fields))
+        finally:
+            self.template.close()
@@ -0,0 +1,122 @@
+import datetime
+import logging
+import threading
+import time
+from mailer.senders import load_credentials, save_credentials
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+HTTP_TIMEOUT = 60
+
+
+class ServicePool:
+    # One Gmail service object per sender credential for the whole session, so
+    # the discovery document is only parsed once per account. httplib2 is not
+    # thread-safe, so each thread gets its own authorized transport per account,
+    # passed to execute(http=...). `api_endpoint` points the services at
+    # another server, e.g. a local fake Gmail for testing.
+    def __init__(self, refresh_margin=REFRESH_MARGIN, metrics=None, api_endpoint=None):
+        self.refresh_margin = refresh_margin
+        self.metrics = metrics
+        self.api_endpoint = api_endpoint
+        self._services = {}
+        self._refresh_locks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _key(self, sender):
+        return sender['token_path']
+
+    def _refresh_lock(self, key):
+        with self._lock:
+            return self._refresh_locks.setdefault(key, threading.Lock())
+
+    def credentials(self, sender):
+        # Token files are only unpickled the first time an account is used
+        if sender.get('creds') is None:
+            with self._refresh_lock(self._key(sender)):
+                if sender.get('creds') is None:
+                    sender['creds'] = load_credentials(sender['token_path'])
+        return sender['creds']
+
+    def ensure_fresh(self, sender):
+        creds = self.credentials(sender)
+        if not getattr(creds, 'refresh_token', None):
+            return
+        expiry = getattr(creds, 'expiry', None)
+        if expiry and not creds.expired and expiry - datetime.datetime.utcnow() > self.refresh_margin:
+            return
+        with self._refresh_lock(self._key(sender)):
+            # Another thread may have refreshed while we waited
+            expiry = creds.expiry
+            if expiry and not creds.expired and expiry - datetime.datetime.utcnow() > self.refresh_margin:
+                return
+            from google.auth.transport.requests import Request
+            start = time.perf_counter()
+            creds.refresh(Request())
+            if self.metrics:
+                self.metrics.observe('token_refresh', time.perf_counter() - start)
+            try:
+                save_credentials(sender['token_path'], creds)
+            except OSError as e:
+                logger.warning("Could not save refreshed token %s: %s", sender['token_path'], e)
+
+    def service(self, sender):
+        key = self._key(sender)
+        service = self._services.get(key)
+        if service is None:
+            creds = self.credentials(sender)
+            with self._lock:
+                service = self._services.get(key)
+                if service is None:
+                    start = time.perf_counter()
+                    service = self._build(creds)
+                    if self.metrics:
+                        self.metrics.observe('service_build', time.perf_counter() - start)
+                    self._services[key] = service
+        return service
+
+    def _build(self, creds):
+        if not self.api_endpoint:
+            from googleapiclient.discovery import build
+            return build('gmail', 'v1', credentials=creds, cache_discovery=False)
+        # client_options only moves the API calls; media uploads and batches
+        # take their URLs from the discovery document, so rewrite that instead
+        import json
+        from googleapiclient import discovery_cache
+        from googleapiclient.discovery import build_from_document
+        doc = json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+        doc['rootUrl'] = doc['mtlsRootUrl'] = self.api_endpoint.rstrip('/') + '/'
+        return build_from_document(doc, credentials=creds)
+
+    def http(self, sender):
+        self.ensure_fresh(sender)
+        transports = getattr(self._local, 'transports', None)
+        if transports is None:
+            transports = self._local.transports = {}
+        key = self._key(sender)
+        transport = transports.get(key)
+        if transport is None or transport.credentials is not sender['creds']:
+            import httplib2
+            import google_auth_httplib2
+            http = httplib2.Http(timeout=HTTP_TIMEOUT)
+            # Resumable uploads answer 308 for "keep going", not as a redirect (as googleapiclient's build_http does)
+            http.redirect_codes = http.redirect_codes - {308}
+            transport = google_auth_httplib2.AuthorizedHttp(sender['creds'], http=http)
+            transports[key] = transport
+        return transport
+
+    def execute(self, sender, request):
+        return request.execute(http=self.http(sender))
+
+    def get_profile(self, sender):
+        return self.execute(sender, self.service(sender).users().getProfile(userId='me'))
+
+    def discard(self, sender):
+        with self._lock:
+            self._services.pop(self._key(sender), None)
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
@@ -0,0 +1,301 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from mailer.recipients import address_key
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 2.0
+# Turns a stored (signed) key back into an address_key
+KEY_MASK = 0xFFFFFFFFFFFFFFFF
+# Statuses a campaign nobody is sending can be claimed from
+CLAIMABLE_STATUSES = ['new', 'queued', 'cancelled']
+LEASE_SECONDS = 300
+# Stored MongoDB datetimes only have millisecond precision, so "now" may not be expired yet
+LEASE_EXPIRED = datetime.datetime(1970, 1, 1)
+# A queued campaign that has failed this many times (errors, or workers that
+# died holding it) is marked failed
+MAX_FAILURES = 3
+
+
+def _signed(key):
+    # MongoDB stores signed 64-bit integers
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def _free(now):
+    # Nobody is sending it: stopped, or its holder stopped renewing the lease
+    return [{'status': {'$in': CLAIMABLE_STATUSES}}, {'status': 'running', 'lease_until': {'$lt': now}}]
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CampaignBusy(Exception):
+    pass
+
+
+class CampaignJournal:
+    # One document per campaign in `campaigns`, one status document per
+    # recipient in `campaign_recipients`. Statuses are buffered and written
+    # with unordered bulk_write calls every FLUSH_SIZE results or
+    # FLUSH_INTERVAL seconds, whichever comes first. Each flush also moves
+    # `resume_row` on the campaign up to the first source row without a
+    # result yet (see advance()), so a resumed campaign starts reading there.
+    #
+    # Whoever sends a campaign, a dashboard or a headless worker (see
+    # mailer/worker.py), holds a lease on it: `worker` and `lease_until` on
+    # the campaign, renewed from a background thread while it is open.
+    # Campaigns are claimed atomically, so only one holder at a time can send
+    # one, and status changes only apply while the journal still holds it.
+    def __init__(self, db, campaign, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, worker=None,
+                 lease=LEASE_SECONDS):
+        self.db = db
+        self.campaign = campaign
+        self.worker = worker or default_worker_id()
+        self.lease = lease
+        # Called from the lease thread if another holder took the campaign over
+        self.on_lost = None
+        self._held = False
+        self._renewing = None
+        self._lease_lock = threading.Lock()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._ops = []
+        self._counts = {}
+        self._row = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def new(cls, db, owner, subject, body, attachments, source_path):
+        return cls(db, {
+            'owner': owner,
+            'subject': subject,
+            'body': body,
+            'attachments': list(attachments),
+            'source_path': source_path,
+            'status': 'new',
+            'sent': 0,
+            'failed_attempts': 0,
+        })
+
+    @classmethod
+    def enqueue(cls, db, owner, subject, body, attachments, source_path, options=None, hold=False):
+        # hold=True stores the campaign as 'new' and keeps it off the queue:
+        # only a claim by id picks it up, and workers never take it over
+        journal = cls.new(db, owner, subject, body, attachments, source_path)
+        now = datetime.datetime.utcnow()
+        journal.campaign.update(status='new' if hold else 'queued', queued=not hold, options=dict(options or {}),
+                                failures=0, created_at=now, updated_at=now)
+        journal.campaign['_id'] = db.campaigns.insert_one(journal.campaign).inserted_id
+        return journal
+
+    @classmethod
+    def claim(cls, db, worker, lease=LEASE_SECONDS, campaign_id=None):
+        # Takes the oldest queued campaign (or a queued one whose worker died),
+        # or the given campaign if it is new, queued or resumable and nobody
+        # holds it. Taking a campaign over from a dead worker counts as one of
+        # its failures; a queued campaign that reaches MAX_FAILURES is marked
+        # failed instead of being sent again.
+        from pymongo import ASCENDING, ReturnDocument
+        while True:
+            now = datetime.datetime.utcnow()
+            if campaign_id is None:
+                query = {'$or': [{'status': 'queued'},
+                                 {'status': 'running', 'queued': True, 'lease_until': {'$lt': now}}]}
+            else:
+                query = {'_id': campaign_id, '$or': _free(now)}
+            # An update pipeline, so the failure count only goes up on takeovers
+            campaign = db.campaigns.find_one_and_update(
+                query,
+                [{'$set': {
+                    'failures': {'$add': [{'$ifNull': ['$failures', 0]},
+                                          {'$cond': [{'$eq': ['$status', 'running']}, 1, 0]}]},
+                    'status': 'running',
+                    'worker': {'$literal': worker},
+                    'lease_until': now + datetime.timedelta(seconds=lease),
+                    'updated_at': now,
+                }}],
+                sort=[('created_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if campaign is None:
+                return None
+            journal = cls(db, campaign, worker=worker, lease=lease)
+            journal._held = True
+            if not campaign.get('queued') or campaign.get('failures', 0) < MAX_FAILURES:
+                return journal
+            journal.fail(f"Stopped after {campaign['failures']} failures; the last worker stopped renewing its lease")
+            if campaign_id is not None:
+                return None
+
+    @classmethod
+    def resumable(cls, db, owner):
+        from pymongo import DESCENDING
+        # Interrupted campaigns nobody is sending right now
+        return list(db.campaigns.find(
+            {'owner': owner, '$or': [{'status': 'cancelled'},
+                                     {'status': 'running', 'lease_until': {'$lt': datetime.datetime.utcnow()}}]},
+            sort=[('updated_at', DESCENDING)],
+        ))
+
+    @property
+    def campaign_id(self):
+        return self.campaign.get('_id')
+
+    @property
+    def resume_row(self):
+        return self.campaign.get('resume_row', 0)
+
+    def _owned(self):
+        return {'_id': self.campaign_id, 'worker': self.worker}
+
+    def renew(self):
+        # False once another holder has taken the campaign over
+        until = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease)
+        result = self.db.campaigns.update_one(dict(self._owned(), status='running'), {'$set': {'lease_until': until}})
+        return result.matched_count == 1
+
+    def _start_renewing(self):
+        self._renewing = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(self._renewing,), name="campaign-lease", daemon=True).start()
+
+    def _stop_renewing(self):
+        # Waits out a renewal in flight, so it cannot land after a release
+        with self._lease_lock:
+            if self._renewing is not None:
+                self._renewing.set()
+                self._renewing = None
+
+    def _renew_lease(self, stopped):
+        while not stopped.wait(self.lease / 3):
+            try:
+                with self._lease_lock:
+                    if stopped.is_set():
+                        return
+                    held = self.renew()
+            except Exception as e:
+                logger.warning("Could not renew the lease on campaign %s: %s", self.campaign_id, e)
+                continue
+            if not held:
+                logger.error("Campaign %s was taken over by another sender", self.campaign_id)
+                if self.on_lost:
+                    self.on_lost()
+                return
+
+    def release(self, error=None):
+        # Hands an unfinished campaign back to the queue, or, if it was never
+        # queued, leaves it cancelled to be resumed by hand; recipients already
+        # sent are skipped when it is picked up again. Releasing with an error
+        # counts as a failure.
+        self._stop_renewing()
+        self.flush()
+        queued = self.campaign.get('queued')
+        update = {'$set': {'status': 'queued' if queued else 'cancelled', 'updated_at': datetime.datetime.utcnow()},
+                  '$unset': {'worker': '', 'lease_until': ''}}
+        if error is not None:
+            failures = self.campaign.get('failures', 0) + 1
+            self.campaign['failures'] = failures
+            update['$set'].update(failures=failures, last_error=str(error))
+            if queued and failures >= MAX_FAILURES:
+                update['$set']['status'] = 'failed'
+        self.db.campaigns.update_one(self._owned(), update)
+
+    def fail(self, error):
+        self._stop_renewing()
+        self.flush()
+        self.db.campaigns.update_one(self._owned(), {
+            '$set': {'status': 'failed', 'last_error': str(error), 'updated_at': datetime.datetime.utcnow()},
+            '$unset': {'lease_until': ''}})
+
+    def open(self):
+        now = datetime.datetime.utcnow()
+        if self.campaign_id is None:
+            self.campaign.update(status='running', worker=self.worker,
+                                 lease_until=now + datetime.timedelta(seconds=self.lease), created_at=now, updated_at=now)
+            self.campaign['_id'] = self.db.campaigns.insert_one(self.campaign).inserted_id
+        elif not self._held:
+            # Resuming: claim it like a worker would, so nobody else sends it meanwhile
+            claimed = self.claim(self.db, self.worker, lease=self.lease, campaign_id=self.campaign_id)
+            if claimed is None:
+                raise CampaignBusy("The campaign is already being sent elsewhere")
+            self.campaign = claimed.campaign
+        self._held = True
+        self._start_renewing()
+
+    def abandon(self):
+        # After a crash: stop renewing and let the lease lapse at once, so the
+        # campaign can be resumed straight away
+        self._stop_renewing()
+        self.flush()
+        self.db.campaigns.update_one(self._owned(), {'$set': {'lease_until': LEASE_EXPIRED}})
+
+    def delivered(self, keys):
+        # The address keys among `keys` that were already sent; one _id lookup
+        if self.campaign_id is None or not keys:
+            return set()
+        ids = [f"{self.campaign_id}:{_signed(key)}" for key in keys]
+        cursor = self.db.campaign_recipients.find({'_id': {'$in': ids}, 'status': 'sent'}, {'key': 1, '_id': 0})
+        return {doc['key'] & KEY_MASK for doc in cursor}
+
+    def advance(self, row):
+        # Every source row before `row` has been recorded; written with the next flush
+        with self._lock:
+            if self._row is None or row > self._row:
+                self._row = row
+
+    def record(self, address, status, sender=None, error=None):
+        from pymongo import UpdateOne
+        key = _signed(address_key(address))
+        op = UpdateOne(
+            {'_id': f"{self.campaign_id}:{key}"},
+            {'$set': {
+                'campaign_id': self.campaign_id,
+                'key': key,
+                'address': address,
+                'status': status,
+                'sender': sender,
+                'error': str(error) if error is not None else None,
+            }},
+            upsert=True,
+        )
+        with self._lock:
+            self._ops.append(op)
+            self._counts[status] = self._counts.get(status, 0) + 1
+            due = len(self._ops) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                ops, self._ops = self._ops, []
+                counts, self._counts = self._counts, {}
+                # Taken together with the ops, so it never runs ahead of what is written
+                row, self._row = self._row, None
+                self._last_flush = time.monotonic()
+            if not ops and row is None:
+                return
+            update = {'$set': {'updated_at': datetime.datetime.utcnow()}}
+            if ops:
+                self.db.campaign_recipients.bulk_write(ops, ordered=False)
+                update['$inc'] = {'sent': counts.get('sent', 0),
+                                  'failed_attempts': sum(n for status, n in counts.items() if status != 'sent')}
+            if row is not None:
+                update['$max'] = {'resume_row': row}
+            self.db.campaigns.update_one({'_id': self.campaign_id}, update)
+
+    def finish(self, cancelled=False):
+        self._stop_renewing()
+        self.flush()
+        self.db.campaigns.update_one(
+            self._owned(),
+            {'$set': {'status': 'cancelled' if cancelled else 'completed', 'updated_at': datetime.datetime.utcnow()},
+             '$unset': {'lease_until': ''}})
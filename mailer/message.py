@@ -0,0 +1,195 @@
+import os
+import io
+import mmap
+import base64
+import tempfile
+import uuid
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Gmail's resumable upload wants every chunk but the last to be a multiple of 256 KB
+UPLOAD_CHUNK_UNIT = 256 * 1024
+MAX_MESSAGE_MEMORY = 8 * 1024 * 1024
+# 57 input bytes make one 76 character base64 line
+ENCODE_CHUNK = 57 * 16 * 1024
+
+
+def _header_value(value):
+    # Headers are patched in as raw bytes, so refuse anything that could start a new header line
+    return ' '.join(str(value).split())
+
+
+def _from_to(sender, to):
+    return b'from: ' + _header_value(sender).encode('utf-8'), b'to: ' + _header_value(to).encode('utf-8')
+
+
+def _subject_header(subject):
+    subject = _header_value(subject)
+    try:
+        return subject.encode('ascii')
+    except UnicodeEncodeError:
+        return Header(subject, 'utf-8').encode().encode('ascii')
+
+
+def _boundary():
+    return '=' * 15 + uuid.uuid4().hex + '=='
+
+
+def write_attachments(out, boundary, attachments):
+    # Everything after the text part: one base64 part per attachment, read
+    # and encoded chunk by chunk so no file is ever held in memory whole,
+    # then the closing delimiter.
+    for file in attachments:
+        out.write(f'\n--{boundary}\n'.encode('ascii'))
+        out.write('Content-Type: application/octet-stream\nMIME-Version: 1.0\nContent-Transfer-Encoding: base64\n'.encode('ascii'))
+        out.write(f'Content-Disposition: attachment; filename="{os.path.basename(file)}"\n\n'.encode('utf-8'))
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(ENCODE_CHUNK), b''):
+                out.write(base64.encodebytes(chunk))
+    out.write(f'\n--{boundary}--\n'.encode('ascii'))
+
+
+def write_message(out, subject, body, attachments, boundary=None):
+    # Writes the message without From/To to `out`
+    boundary = boundary or _boundary()
+    message = MIMEMultipart(boundary=boundary)
+    message['subject'] = subject
+    message.attach(MIMEText(body, 'html'))
+    skeleton = message.as_bytes()
+    close = f'\n--{boundary}--\n'.encode('ascii')
+    out.write(skeleton[:-len(close)])
+    write_attachments(out, boundary, attachments)
+
+
+class _MessageStream(io.RawIOBase):
+    # Per-recipient headers followed by the shared read-only mapping of the
+    # spooled message. Each stream only keeps its own position.
+    def __init__(self, head, body):
+        self._head = head
+        self._body = body
+        self._size = len(head) + len(body)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size=-1):
+        # Slicing the mapping copies exactly one chunk; the RawIOBase default would copy it twice
+        end = self._size if size is None or size < 0 else min(self._size, self._pos + size)
+        if end <= self._pos:
+            return b''
+        head = len(self._head)
+        if self._pos >= head:
+            data = self._body[self._pos - head:end - head]
+        else:
+            with memoryview(self._body) as body:
+                data = b''.join((self._head[self._pos:end], body[0:max(0, end - head)]))
+        self._pos = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        memoryview(buffer).cast('B')[:len(data)] = data
+        return len(data)
+
+
+class MessageTemplate:
+    # Builds the MIME tree, reads attachments and base64-encodes them once per
+    # campaign into a spooled temp file. Only the To/From lines are produced
+    # per recipient, plus the subject and text part when a MailMerge with
+    # placeholders is given; attachments are shared either way.
+    #
+    # Small messages are kept urlsafe-encoded in memory and sent inline: the
+    # per-recipient lines are padded to a multiple of 3 bytes so their base64
+    # can be prefixed to the pre-encoded remainder without re-encoding it.
+    # Messages whose inline request would cost more than `max_message_memory`
+    # (the raw string plus its JSON-serialized copy) are streamed from a
+    # memory map through Gmail's resumable media upload, `chunksize` bytes at
+    # a time.
+    def __init__(self, subject, body, attachments, max_message_memory=MAX_MESSAGE_MEMORY, merge=None):
+        self.max_message_memory = max_message_memory
+        self.chunksize = max(UPLOAD_CHUNK_UNIT, max_message_memory // UPLOAD_CHUNK_UNIT * UPLOAD_CHUNK_UNIT)
+        self.merge = merge if merge is not None and merge.personalized else None
+        self._encoded_rest = None
+        self._spool = None
+        self._body = None
+        boundary = _boundary()
+        spool = tempfile.TemporaryFile(prefix='message-')
+        try:
+            if self.merge is None:
+                write_message(spool, subject, body, attachments, boundary)
+                self.size = spool.tell()
+            else:
+                self._multipart_head = (
+                    f'Content-Type: multipart/mixed; boundary="{boundary}"\nMIME-Version: 1.0\n\n--{boundary}\n'
+                    'Content-Type: text/html; charset="utf-8"\nMIME-Version: 1.0\nContent-Transfer-Encoding: base64\n\n'
+                ).encode('ascii')
+                write_attachments(spool, boundary, attachments)
+                # Per-recipient values change the text part a little; the template body is close enough
+                self.size = spool.tell() + len(self._multipart_head) + (len(body.encode('utf-8')) + 2) // 3 * 4
+            self.streamed = 2 * (self.size + 2) // 3 * 4 > max_message_memory
+            if self.streamed:
+                spool.flush()
+                self._body = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+                self._spool = spool
+                return
+            spool.seek(0)
+            self._encoded_rest = base64.urlsafe_b64encode(spool.read()).decode()
+        except BaseException:
+            spool.close()
+            raise
+        spool.close()
+
+    def _personal_head(self, row):
+        subject, body = self.merge.render(row)
+        return b'subject: ' + _subject_header(subject) + b'\n' + self._multipart_head + \
+            base64.encodebytes(body.encode('utf-8'))
+
+    def _head(self, sender, to, row, pad):
+        sender, to = _from_to(sender, to)
+        rest = self._personal_head(row) if self.merge is not None else b''
+        # Whitespace after the header colon is ignored by parsers, so it is used as padding
+        n = -(len(sender) + len(to) + 2 + len(rest)) % 3 if pad else 0
+        return sender + b'\n' + to[:4] + b' ' * n + to[4:] + b'\n' + rest
+
+    def render(self, sender, to, row=None):
+        # `row` is the recipient's CSV row, address first; only used with a MailMerge
+        if self.streamed:
+            raise ValueError("Message is too large to send inline; use request() instead")
+        raw = base64.urlsafe_b64encode(self._head(sender, to, row, pad=True)).decode() + self._encoded_rest
+        return {'raw': raw}
+
+    def stream(self, sender, to, row=None):
+        return _MessageStream(self._head(sender, to, row, pad=False), self._body)
+
+    def request(self, messages, sender, to, row=None):
+        # `messages` is service.users().messages()
+        if not self.streamed:
+            return messages.send(userId='me', body=self.render(sender, to, row))
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(self.stream(sender, to, row), mimetype='message/rfc822',
+                                  chunksize=self.chunksize, resumable=True)
+        return messages.send(userId='me', body={}, media_body=media)
+
+    def close(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
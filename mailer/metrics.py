@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, Prometheus style; the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+EXPORT_INTERVAL = 5.0
+DEFAULT_EXPORT_PATH = 'send_metrics.prom'
+
+
+def error_type(error):
+    # HttpError carries the status; "HttpError 429" is more useful than the class alone
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    name = type(error).__name__
+    return f"{name} {status}" if status else name
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class Metrics:
+    # Per-stage latency histograms, per-sender send counts and error counts by
+    # type. Histograms and counters are cumulative for the session, as
+    # Prometheus expects; start_campaign() only moves the baseline that the
+    # per-campaign counts and messages/sec are measured from. Everything is
+    # guarded by one lock and recording is a few dict updates. With
+    # `export_path` set, a snapshot is written at most every
+    # `export_interval` seconds as Prometheus text (.prom/.txt) or JSON.
+    def __init__(self, export_path=None, export_interval=EXPORT_INTERVAL):
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._stages = {}
+        self._sent = {}
+        self._failed = {}
+        self._errors = {}
+        self._retries = {}
+        self._last_export = time.monotonic()
+        self.start_campaign()
+
+    def start_campaign(self):
+        with self._lock:
+            self._started = time.monotonic()
+            self._baseline = (dict(self._sent), dict(self._failed), sum(self._errors.values()))
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+        self._maybe_export()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage, fn):
+        def wrapper(*args, **kwargs):
+            with self.timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def result(self, sender, error=None):
+        with self._lock:
+            if error is None:
+                self._sent[sender] = self._sent.get(sender, 0) + 1
+            else:
+                kind = error_type(error)
+                self._errors[kind] = self._errors.get(kind, 0) + 1
+                if sender:
+                    self._failed[sender] = self._failed.get(sender, 0) + 1
+        self._maybe_export()
+
+    def retried(self, error):
+        with self._lock:
+            kind = error_type(error)
+            self._retries[kind] = self._retries.get(kind, 0) + 1
+        self._maybe_export()
+
+    def snapshot(self):
+        # sent/failed/errors/rates cover the current campaign, *_total the session
+        with self._lock:
+            elapsed = time.monotonic() - self._started
+            base_sent, base_failed, base_errors = self._baseline
+            senders = {}
+            for sender in set(self._sent) | set(self._failed):
+                sent = self._sent.get(sender, 0) - base_sent.get(sender, 0)
+                failed = self._failed.get(sender, 0) - base_failed.get(sender, 0)
+                senders[sender] = {
+                    'sent': sent,
+                    'failed': failed,
+                    'sent_total': self._sent.get(sender, 0),
+                    'failed_total': self._failed.get(sender, 0),
+                    'rate': sent / elapsed if elapsed > 0 else 0.0,
+                    'error_rate': failed / (sent + failed) if sent + failed else 0.0,
+                }
+            sent = sum(s['sent'] for s in senders.values())
+            errors = sum(self._errors.values()) - base_errors
+            return {
+                'elapsed': elapsed,
+                'sent': sent,
+                'errors': errors,
+                'rate': sent / elapsed if elapsed > 0 else 0.0,
+                'error_rate': errors / (sent + errors) if sent + errors else 0.0,
+                'senders': senders,
+                'error_types': dict(self._errors),
+                'retries': dict(self._retries),
+                'stages': {stage: h.snapshot() for stage, h in self._stages.items()},
+            }
+
+    def to_prometheus(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = ['# TYPE bulk_email_stage_seconds histogram']
+        for stage, h in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, n in h['buckets'].items():
+                cumulative += n
+                lines.append(f'bulk_email_stage_seconds_bucket{{stage="{_label(stage)}",le="{bound}"}} {cumulative}')
+            lines.append(f'bulk_email_stage_seconds_sum{{stage="{_label(stage)}"}} {h["sum"]:.6f}')
+            lines.append(f'bulk_email_stage_seconds_count{{stage="{_label(stage)}"}} {h["count"]}')
+        lines.append('# TYPE bulk_email_sent_total counter')
+        for sender, s in sorted(snapshot['senders'].items()):
+            lines.append(f'bulk_email_sent_total{{sender="{_label(sender)}"}} {s["sent_total"]}')
+        lines.append('# TYPE bulk_email_failed_total counter')
+        for sender, s in sorted(snapshot['senders'].items()):
+            lines.append(f'bulk_email_failed_total{{sender="{_label(sender)}"}} {s["failed_total"]}')
+        lines.append('# TYPE bulk_email_send_rate gauge')
+        for sender, s in sorted(snapshot['senders'].items()):
+            lines.append(f'bulk_email_send_rate{{sender="{_label(sender)}"}} {s["rate"]:.3f}')
+        lines.append('# TYPE bulk_email_errors_total counter')
+        for kind, n in sorted(snapshot['error_types'].items()):
+            lines.append(f'bulk_email_errors_total{{type="{_label(kind)}"}} {n}')
+        lines.append('# TYPE bulk_email_retries_total counter')
+        for kind, n in sorted(snapshot['retries'].items()):
+            lines.append(f'bulk_email_retries_total{{type="{_label(kind)}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        path = path or self.export_path
+        if not path:
+            return
+        with self._export_lock:
+            snapshot = self.snapshot()
+            if path.endswith('.json'):
+                text = json.dumps(snapshot, indent=2, sort_keys=True)
+            else:
+                text = self.to_prometheus(snapshot)
+            # Write-then-rename so a scraper never reads half a file
+            tmp = f"{path}.tmp"
+            with open(tmp, 'w') as f:
+                f.write(text)
+            os.replace(tmp, path)
+
+    def _maybe_export(self):
+        if not self.export_path:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_export < self.export_interval:
+                return
+            self._last_export = now
+        try:
+            self.export()
+        except OSError as e:
+            logger.warning("Could not export metrics to %s: %s", self.export_path, e)
@@ -0,0 +1,161 @@
+import datetime
+import threading
+import time
+
+DEFAULT_SEND_RATE = 2.0
+DEFAULT_BURST = 5
+WINDOW_HOURS = 24
+
+
+def _hour_bucket(moment):
+    return moment.strftime('%Y%m%d%H')
+
+
+class TokenBucket:
+    def __init__(self, rate=DEFAULT_SEND_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, n):
+        # Returns 0 if the tokens were taken, otherwise the seconds to wait
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0
+            return (n - self._tokens) / self.rate
+
+    def acquire(self, n=1, should_continue=None):
+        # Requests larger than the burst size are taken in burst-sized steps
+        while n > 0:
+            step = min(n, self.capacity)
+            wait = self._take(step)
+            if not wait:
+                n -= step
+                continue
+            if should_continue and not should_continue():
+                return False
+            time.sleep(min(wait, 0.5))
+        return True
+
+
+class QuotaManager:
+    # Rolling 24h send counters per sender account, kept in the `sender_quota`
+    # collection as hourly buckets so they survive restarts and are shared by
+    # every campaign, dashboard and worker. Sends are counted before they are
+    # made: reserve() adds a block to the current hour with one conditional
+    # update that only applies while the window still has room, so
+    # concurrent campaigns cannot hand out more than `limit` between them.
+    # Reserved sends that were not used go back with release().
+    def __init__(self, db=None, rate=DEFAULT_SEND_RATE, burst=DEFAULT_BURST):
+        self.db = db
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._memory = {}
+        self._blocked = {}
+        self._lock = threading.Lock()
+
+    def _window(self, now):
+        return [_hour_bucket(now - datetime.timedelta(hours=h)) for h in range(WINDOW_HOURS)]
+
+    def _load(self, email):
+        if self.db is None:
+            return dict(self._memory.get(email, {})), self._blocked.get(email)
+        doc = self.db.sender_quota.find_one({'_id': email}) or {}
+        return doc.get('hours', {}), doc.get('blocked_until')
+
+    def used(self, email):
+        window = set(self._window(datetime.datetime.utcnow()))
+        hours, _ = self._load(email)
+        return sum(n for hour, n in hours.items() if hour in window)
+
+    def remaining(self, sender):
+        self.prune(sender['email'])
+        _, blocked_until = self._load(sender['email'])
+        if blocked_until and blocked_until > datetime.datetime.utcnow():
+            return 0
+        return max(0, sender['limit'] - self.used(sender['email']))
+
+    def bucket(self, email):
+        with self._lock:
+            bucket = self._buckets.get(email)
+            if bucket is None:
+                bucket = self._buckets[email] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def acquire(self, email, n=1, should_continue=None):
+        return self.bucket(email).acquire(n, should_continue)
+
+    def reserve(self, sender, n):
+        # Takes up to n sends from the account's window. Returns (granted,
+        # hour); granted is 0 once the window is full or the account is blocked.
+        email, limit = sender['email'], sender['limit']
+        now = datetime.datetime.utcnow()
+        hour = _hour_bucket(now)
+        window = self._window(now)
+        if self.db is None:
+            with self._lock:
+                blocked_until = self._blocked.get(email)
+                if blocked_until and blocked_until > now:
+                    return 0, hour
+                hours = self._memory.setdefault(email, {})
+                granted = max(0, min(n, limit - sum(hours.get(h, 0) for h in window)))
+                if granted:
+                    hours[hour] = hours.get(hour, 0) + granted
+                return granted, hour
+        used = {'$add': [{'$ifNull': [f'$hours.{h}', 0]} for h in window]}
+        while True:
+            hours, blocked_until = self._load(email)
+            if blocked_until and blocked_until > now:
+                return 0, hour
+            if not hours:
+                # The conditional update below needs the document to exist
+                self.db.sender_quota.update_one({'_id': email}, {'$setOnInsert': {'hours': {}}}, upsert=True)
+            elif min(hours) < window[-1]:
+                self.prune(email)
+            granted = min(n, limit - sum(hours.get(h, 0) for h in window))
+            if granted <= 0:
+                return 0, hour
+            result = self.db.sender_quota.update_one(
+                {'_id': email, '$expr': {'$lte': [used, limit - granted]},
+                 '$or': [{'blocked_until': None}, {'blocked_until': {'$lte': now}}]},
+                {'$inc': {f'hours.{hour}': granted}})
+            if result.matched_count:
+                return granted, hour
+            # Another campaign reserved in between; look again
+
+    def release(self, email, n, hour):
+        # Gives back reserved sends that were never made
+        if n <= 0:
+            return
+        if self.db is None:
+            with self._lock:
+                hours = self._memory.get(email, {})
+                if hour in hours:
+                    hours[hour] = max(0, hours[hour] - n)
+            return
+        self.db.sender_quota.update_one({'_id': email}, {'$inc': {f'hours.{hour}': -n}})
+
+    def block(self, email, until=None):
+        # Gmail said the account is over its limit: stop using it until the
+        # retry time it gave, or until the window has passed if it gave none.
+        # An existing later block is kept.
+        until = until or datetime.datetime.utcnow() + datetime.timedelta(hours=WINDOW_HOURS)
+        if self.db is None:
+            with self._lock:
+                self._blocked[email] = max(until, self._blocked.get(email) or until)
+        else:
+            self.db.sender_quota.update_one({'_id': email}, {'$max': {'blocked_until': until}}, upsert=True)
+
+    def prune(self, email):
+        oldest = _hour_bucket(datetime.datetime.utcnow() - datetime.timedelta(hours=WINDOW_HOURS))
+        hours, _ = self._load(email)
+        stale = [h for h in hours if h < oldest]
+        if stale and self.db is not None:
+            self.db.sender_quota.update_one({'_id': email}, {'$unset': {f'hours.{h}': '' for h in stale}})
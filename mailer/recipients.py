@@ -0,0 +1,152 @@
+import hashlib
+from array import array
+from bisect import bisect_right
+
+CHUNK_SIZE = 50000
+
+
+def address_key(address):
+    # 64-bit digest instead of the string itself keeps the dedupe set small for huge lists
+    return int.from_bytes(hashlib.blake2b(address.lower().encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class CompactStringStore:
+    # All strings live in one newline-separated bytearray with an offsets
+    # array, about one machine word of overhead per row instead of a Python
+    # object (or a QListWidgetItem) each.
+    def __init__(self, items=()):
+        self.clear()
+        self.extend(items)
+
+    def clear(self):
+        self._data = bytearray()
+        self._offsets = array('Q')
+        self._folded = None
+
+    def append(self, item):
+        self._offsets.append(len(self._data))
+        self._data += item.replace('\n', ' ').encode('utf-8')
+        self._data += b'\n'
+        self._folded = None
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _end(self, row):
+        return self._offsets[row + 1] - 1 if row + 1 < len(self._offsets) else len(self._data) - 1
+
+    def __getitem__(self, row):
+        return self._data[self._offsets[row]:self._end(row)].decode('utf-8')
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def find_rows(self, text):
+        # Case-insensitive substring search over the whole buffer at once; rows
+        # are newline-separated so a match can never span two of them.
+        needle = text.replace('\n', ' ').lower().encode('utf-8')
+        if not needle:
+            return array('Q', range(len(self)))
+        if self._folded is None:
+            self._folded = self._data.lower()
+        rows = array('Q')
+        pos = self._folded.find(needle)
+        while pos != -1:
+            row = bisect_right(self._offsets, pos) - 1
+            rows.append(row)
+            pos = self._folded.find(needle, self._end(row) + 1)
+        return rows
+
+
+class RecipientSource:
+    # Streams the first column of a CSV in chunks; nothing but the dedupe
+    # hashes stays in memory. The remaining columns are only read when a
+    # campaign uses them as mail-merge fields (see numbered()).
+    def __init__(self, path, chunksize=CHUNK_SIZE):
+        self.path = path
+        self.chunksize = chunksize
+        self.total_rows = 0
+        self.unique = 0
+        self.duplicates = 0
+        self._columns = None
+
+    @property
+    def columns(self):
+        # Header row, address column first
+        if self._columns is None:
+            self._columns = self._read_columns()
+        return self._columns
+
+    def _read_columns(self):
+        import pandas as pd
+        return [str(column) for column in pd.read_csv(self.path, nrows=0).columns]
+
+    def _chunks(self, start=0, **options):
+        # Chunks from data row `start` on. Chunks before it are only parsed by
+        # pandas, never turned into Python objects.
+        import pandas as pd
+        for chunk in pd.read_csv(self.path, chunksize=self.chunksize, **options):
+            if not len(chunk) or chunk.index[-1] < start:
+                continue
+            if chunk.index[0] < start:
+                chunk = chunk.iloc[start - chunk.index[0]:]
+            yield chunk
+
+    def _addresses(self, start=0):
+        # (row number, address) pairs
+        for chunk in self._chunks(start, usecols=[0], dtype=str):
+            for row, address in chunk.iloc[:, 0].dropna().items():
+                address = address.strip()
+                if address:
+                    yield int(row), address
+
+    def _rows(self, start=0):
+        for chunk in self._chunks(start, dtype=str, keep_default_na=False):
+            for row in chunk.itertuples(index=True, name=None):
+                address = row[1].strip()
+                if address:
+                    yield int(row[0]), (address,) + row[2:]
+
+    def numbered(self, start=0, with_fields=False):
+        # De-duplicated (row number, address) pairs from data row `start` on,
+        # or (row number, whole row) with `with_fields`: (address, column 2, ...). Row numbers count
+        # every data row of the file, blank and duplicate ones included.
+        seen = set()
+        for row, item in (self._rows(start) if with_fields else self._addresses(start)):
+            key = address_key(item[0] if with_fields else item)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield row, item
+
+    def scan(self, sink=None, should_continue=None):
+        # Returns None if should_continue() turned False; it is checked once per chunk
+        total = unique = 0
+        seen = set()
+        for _, address in self._addresses():
+            total += 1
+            if should_continue is not None and not total % self.chunksize and not should_continue():
+                return None
+            key = address_key(address)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique += 1
+            if sink is not None:
+                sink(address)
+        self.total_rows = total
+        self.unique = unique
+        self.duplicates = total - unique
+        self._columns = self._read_columns()
+        return self
+
+    def __len__(self):
+        return self.unique
+
+    def __iter__(self):
+        return (address for _, address in self.numbered())
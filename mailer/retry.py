@@ -0,0 +1,155 @@
+import datetime
+import email.utils
+import http.client
+import json
+import random
+import re
+import time
+from mailer.dispatcher import QuotaExhausted
+
+TRANSIENT = 'transient'
+QUOTA = 'quota'
+PERMANENT = 'permanent'
+
+DEFAULT_ATTEMPTS = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 32.0
+
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+# Statuses Gmail uses for rate and sending limits
+LIMIT_STATUSES = {403, 429}
+QUOTA_REASONS = {'dailyLimitExceeded', 'quotaExceeded', 'limitExceeded'}
+TRANSIENT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError', 'internalError'}
+QUOTA_PHRASES = ('daily limit', 'sending limit')
+# Gmail reports an account over its sending limit as a rate limit with a
+# retry time hours away; a retry time closer than this is just backoff
+QUOTA_AFTER = 300
+# "User-rate limit exceeded.  Retry after 2024-05-01T12:00:00.000Z"
+RETRY_AFTER_TIME = re.compile(r'retry after (\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)Z', re.IGNORECASE)
+
+
+def _http_error_details(error):
+    # (status, reasons, message) of a googleapiclient HttpError, without importing it
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status is None:
+        return None
+    reasons = set()
+    message = str(error)
+    content = getattr(error, 'content', b'') or b''
+    try:
+        payload = json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+        details = payload.get('error', {})
+        message = details.get('message') or message
+        reasons = {e.get('reason') for e in details.get('errors', []) if e.get('reason')}
+    except (ValueError, AttributeError):
+        pass
+    return int(status), reasons, message
+
+
+def classify(error):
+    if isinstance(error, QuotaExhausted):
+        return QUOTA
+    details = _http_error_details(error)
+    if details is not None:
+        status, reasons, message = details
+        if reasons & QUOTA_REASONS:
+            return QUOTA
+        if status in LIMIT_STATUSES:
+            wait = retry_after(error)
+            if wait is not None:
+                return QUOTA if wait > QUOTA_AFTER else TRANSIENT
+            if any(phrase in message.lower() for phrase in QUOTA_PHRASES):
+                return QUOTA
+        if status in TRANSIENT_STATUSES or reasons & TRANSIENT_REASONS:
+            return TRANSIENT
+        return PERMANENT
+    # Timeouts, resets, DNS failures and dropped connections
+    if isinstance(error, (OSError, http.client.HTTPException)) or type(error).__module__.startswith('httplib2'):
+        return TRANSIENT
+    return PERMANENT
+
+
+def retry_after(error, now=None):
+    # Seconds until the server said to retry: a Retry-After header (seconds
+    # or an HTTP date), or the time Gmail puts in the message. None if neither.
+    now = now or datetime.datetime.utcnow()
+    resp = getattr(error, 'resp', None)
+    header = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+        try:
+            at = email.utils.parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            at = None
+        if at is not None:
+            if at.tzinfo is not None:
+                at = at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return max(0.0, (at - now).total_seconds())
+    details = _http_error_details(error)
+    match = RETRY_AFTER_TIME.search(details[2]) if details else None
+    if match:
+        try:
+            at = datetime.datetime.fromisoformat(match.group(1))
+        except ValueError:
+            return None
+        return max(0.0, (at - now).total_seconds())
+    return None
+
+
+def quota_exhausted(error):
+    # What a quota error becomes: a QuotaExhausted carrying Gmail's retry
+    # time, if it gave one, so the account is only blocked until then
+    wait = retry_after(error)
+    until = datetime.datetime.utcnow() + datetime.timedelta(seconds=wait) if wait is not None else None
+    return QuotaExhausted(str(error), until=until)
+
+
+class RetryPolicy:
+    # Full-jitter exponential backoff: attempt n waits uniform(0, min(max_delay,
+    # base_delay * 2**n)), or the server's Retry-After if that is longer (up
+    # to QUOTA_AFTER; later ones are quota errors). Only transient errors are
+    # retried; sleeping is cut short on cancel.
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY, rng=None):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = (rng or random.Random()).uniform
+
+    def delay(self, attempt, error=None):
+        delay = self._random(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = retry_after(error)
+        if hint is not None:
+            delay = max(delay, min(hint, QUOTA_AFTER))
+        return delay
+
+    def sleep(self, seconds, should_continue=None):
+        deadline = time.monotonic() + seconds
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return True
+            if should_continue and not should_continue():
+                return False
+            time.sleep(min(left, 0.5))
+
+    def call(self, fn, should_continue=None, on_retry=None):
+        # Returns fn()'s result; raises the last error with `retry_class` set on it
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                kind = classify(e)
+                attempt += 1
+                if kind != TRANSIENT or attempt >= self.attempts:
+                    e.retry_class = kind
+                    raise
+                if on_retry:
+                    on_retry(e, attempt)
+                if not self.sleep(self.delay(attempt - 1, e), should_continue):
+                    e.retry_class = kind
+                    raise
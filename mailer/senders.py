@@ -0,0 +1,81 @@
+import glob
+import json
+import logging
+import os
+import pickle
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 500
+PROFILE_WORKERS = 8
+_TOKEN_NAME = re.compile(r'^token_(.+)\.pickle$')
+
+
+def meta_path(token_path):
+    # token_<email>.pickle -> token_<email>.json
+    return os.path.splitext(token_path)[0] + '.json'
+
+
+def read_meta(token_path):
+    try:
+        with open(meta_path(token_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(token_path, email):
+    with open(meta_path(token_path), 'w') as f:
+        json.dump({'email': email}, f)
+
+
+def load_credentials(token_path):
+    with open(token_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_credentials(token_path, creds, email=None):
+    with open(token_path, 'wb') as f:
+        pickle.dump(creds, f)
+    if email:
+        write_meta(token_path, email)
+
+
+def load_senders(directory):
+    # No unpickling and no network here: the address comes from the cached
+    # metadata (or the token file name) and credentials are loaded on first use.
+    senders = []
+    for token_path in sorted(glob.glob(os.path.join(directory, 'token_*.pickle'))):
+        meta = read_meta(token_path)
+        if meta and meta.get('email'):
+            email, verified = meta['email'], True
+        else:
+            match = _TOKEN_NAME.match(os.path.basename(token_path))
+            email, verified = (match.group(1) if match else 'Unknown'), False
+        senders.append({'email': email, 'creds': None, 'token_path': token_path,
+                        'limit': DEFAULT_LIMIT, 'verified': verified})
+    return senders
+
+
+def refresh_profiles(service_pool, senders, only_unverified=False):
+    # Runs getProfile for every sender in parallel and rewrites the metadata.
+    # Returns a list of (sender, error) for the accounts that failed.
+    targets = [s for s in senders if not (only_unverified and s.get('verified'))]
+
+    def refresh(sender):
+        try:
+            profile = service_pool.get_profile(sender)
+        except Exception as e:
+            logger.warning("Failed to refresh sender %s: %s", sender['token_path'], e)
+            return sender, e
+        sender['email'] = profile.get('emailAddress', sender['email'])
+        sender['verified'] = True
+        write_meta(sender['token_path'], sender['email'])
+        return sender, None
+
+    if not targets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(PROFILE_WORKERS, len(targets)), thread_name_prefix="profile") as pool:
+        return [(sender, error) for sender, error in pool.map(refresh, targets) if error is not None]
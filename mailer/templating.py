@@ -0,0 +1,101 @@
+import html
+import re
+from operator import itemgetter
+
+FIELD = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+ADDRESS_FIELD = 'email'
+_HTML_SPECIAL = re.compile('[&<>"\']').search
+
+
+def field_name(column):
+    # "First Name" -> first_name
+    name = re.sub(r'\W+', '_', str(column).strip().lower()).strip('_')
+    return name if name and not name[0].isdigit() else f'_{name}'
+
+
+def field_index(columns):
+    # Placeholder name -> row position. The first column is the address and
+    # can always be used as {email} too.
+    index = {}
+    for i, column in enumerate(columns):
+        index.setdefault(field_name(column), i)
+    if index:
+        index.setdefault(ADDRESS_FIELD, 0)
+    return index
+
+
+def escape_html(value):
+    # Most merge values (names, cities) have nothing to escape
+    return html.escape(value) if _HTML_SPECIAL(value) else value
+
+
+class CompiledTemplate:
+    # `{name}` placeholders are resolved to row positions once per campaign and
+    # the text is split into its literal pieces, so rendering a row is one
+    # itemgetter call, a list copy and a join: the literals are never scanned
+    # again. Anything else in braces (CSS in the HTML body, for one) is left
+    # untouched.
+    def __init__(self, text, columns=(), escape=None):
+        index = field_index(columns)
+        self.text = text
+        self.escape = escape
+        self.fields = []
+        self.unknown = []
+        positions = []
+        parts = []
+        pos = 0
+        for match in FIELD.finditer(text):
+            name = field_name(match.group(1))
+            if name not in index:
+                if match.group(1) not in self.unknown:
+                    self.unknown.append(match.group(1))
+                continue
+            if name not in self.fields:
+                self.fields.append(name)
+            parts.append(text[pos:match.start()])
+            parts.append(None)
+            positions.append(index[name])
+            pos = match.end()
+        parts.append(text[pos:])
+        self._parts = parts
+        if len(positions) == 1:
+            only = positions[0]
+            self._values = lambda row: (row[only],)
+        elif positions:
+            self._values = itemgetter(*positions)
+        else:
+            self._values = None
+
+    @property
+    def static(self):
+        return self._values is None
+
+    def render(self, row):
+        if self._values is None:
+            return self.text
+        parts = self._parts.copy()
+        if self.escape is not None:
+            parts[1::2] = map(self.escape, self._values(row))
+        else:
+            parts[1::2] = self._values(row)
+        return ''.join(parts)
+
+
+class MailMerge:
+    # Subject and HTML body compiled against the CSV header. Rows are tuples
+    # in column order with the recipient address first.
+    def __init__(self, subject, body, columns=()):
+        self.columns = list(columns)
+        self.subject = CompiledTemplate(subject, self.columns)
+        self.body = CompiledTemplate(body, self.columns, escape=escape_html)
+
+    @property
+    def personalized(self):
+        return not (self.subject.static and self.body.static)
+
+    @property
+    def unknown(self):
+        return sorted(set(self.subject.unknown) | set(self.body.unknown))
+
+    def render(self, row):
+        return self.subject.render(row), self.body.render(row)
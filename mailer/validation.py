@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from mailer.recipients import address_key
+
+DEFAULT_WORKERS = 8
+BATCH_SIZE = 500
+
+
+class ValidationSummary:
+    def __init__(self):
+        self.valid = 0
+        self.invalid = 0
+        self.duplicates = 0
+
+    def __repr__(self):
+        return f"ValidationSummary(valid={self.valid}, invalid={self.invalid}, duplicates={self.duplicates})"
+
+
+def _normalized(result):
+    # email-validator 2.x renamed `email` to `normalized`
+    return getattr(result, 'normalized', None) or result.email
+
+
+class RecipientValidator:
+    # Caches deliverability (DNS) results per domain, so a list dominated by a
+    # few domains does one lookup per domain. Addresses are not cached: the
+    # recipient source already de-duplicates them and a per-address cache
+    # would grow with the list.
+    def __init__(self, workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE, check_deliverability=True):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.check_deliverability = check_deliverability
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    def validate(self, address):
+        # Returns (normalized address, None) or (None, error)
+        from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
+        domain = address.lower().rpartition('@')[2]
+        domain_error = self._domains.get(domain)
+        try:
+            if domain_error is not None:
+                if domain_error:
+                    raise EmailUndeliverableError(domain_error)
+                result = validate_email(address, check_deliverability=False)
+            else:
+                result = validate_email(address, check_deliverability=self.check_deliverability)
+                with self._lock:
+                    self._domains[domain] = ''
+            return _normalized(result), None
+        except EmailUndeliverableError as e:
+            with self._lock:
+                self._domains[domain] = str(e)
+            return None, e
+        except EmailNotValidError as e:
+            return None, e
+
+    def _validate_batch(self, batch, key):
+        if key is None:
+            return [(address,) + self.validate(address) for address in batch]
+        return [(item,) + self.validate(key(item)) for item in batch]
+
+    def _batches(self, addresses):
+        batch = []
+        for address in addresses:
+            batch.append(address)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def validate_all(self, addresses, summary=None, should_continue=None, key=None):
+        # Yields (address, normalized, error) in input order. Only a bounded
+        # number of batches is in flight, so streamed sources stay streamed.
+        # With `key`, items are whole rows and `key(item)` is the address;
+        # the row is yielded in place of the address.
+        summary = summary if summary is not None else ValidationSummary()
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="validate") as pool:
+            pending = deque()
+            batches = self._batches(addresses)
+            while True:
+                while len(pending) < self.workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    pending.append(pool.submit(self._validate_batch, batch, key))
+                if not pending:
+                    return
+                if should_continue and not should_continue():
+                    for future in pending:
+                        future.cancel()
+                    return
+                for address, normalized, error in pending.popleft().result():
+                    if error is not None:
+                        summary.invalid += 1
+                    else:
+                        digest = address_key(normalized)
+                        if digest in seen:
+                            summary.duplicates += 1
+                            continue
+                        seen.add(digest)
+                        summary.valid += 1
+                    yield address, normalized, error
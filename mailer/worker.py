@@ -0,0 +1,152 @@
+import logging
+import os
+import socket
+import threading
+import time
+from mailer.engine import SendEngine
+from mailer.gmail_service import ServicePool
+from mailer.journal import CampaignJournal, LEASE_SECONDS, default_worker_id
+from mailer.metrics import Metrics
+from mailer.recipients import RecipientSource
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 10.0
+# Longest wait between queue checks while the database keeps failing
+MAX_ERROR_BACKOFF = 300.0
+PROGRESS_INTERVAL = 5.0
+# Engine options a queued campaign may set for itself
+CAMPAIGN_OPTIONS = ('concurrency', 'batch_size', 'max_message_memory')
+
+
+class CampaignFailed(Exception):
+    # A claimed campaign stopped with an error and was released with it
+    pass
+
+
+class ProgressLog:
+    # on_progress callback for headless runs: one log line every `interval` seconds
+    def __init__(self, label, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.interval = interval
+        self._last = 0.0
+
+    def __call__(self, done, total, rate, dest):
+        now = time.monotonic()
+        if now - self._last < self.interval and done < total:
+            return
+        self._last = now
+        logger.info("%s: %d/%d done, %.1f emails/sec", self.label, done, total, rate)
+
+
+class CampaignWorker:
+    # Pulls queued campaigns from MongoDB and sends them one at a time with the
+    # same engine the dashboard uses. Any number of workers can share a queue:
+    # a campaign is claimed with one find_one_and_update and its journal
+    # renews a lease on it while sending. If a worker dies its campaign
+    # is picked up again once the lease runs out, and the journal skips the
+    # recipients that were already sent. Sender quotas are shared through
+    # `sender_quota` like they are between dashboards.
+    def __init__(self, db, senders, quota=None, service_pool=None, metrics=None, worker_id=None,
+                 lease=LEASE_SECONDS, poll_interval=POLL_INTERVAL, engine_options=None):
+        self.db = db
+        self.senders = senders
+        self.quota = quota
+        self.metrics = metrics or Metrics()
+        self.service_pool = service_pool or ServicePool(metrics=self.metrics)
+        self.worker_id = worker_id or default_worker_id()
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.engine_options = dict(engine_options or {})
+        self.engine = None
+        self._stopping = threading.Event()
+
+    def stop(self):
+        # Shutdown: the current campaign is interrupted and goes back to the queue
+        self._stopping.set()
+        engine = self.engine
+        if engine is not None:
+            engine.cancel()
+
+    def cancel(self):
+        # The current campaign is marked cancelled, to be resumed by hand
+        engine = self.engine
+        if engine is not None:
+            engine.cancel()
+
+    @property
+    def stopping(self):
+        return self._stopping.is_set()
+
+    def run(self, once=False):
+        from pymongo.errors import PyMongoError
+        logger.info("Worker %s waiting for campaigns", self.worker_id)
+        backoff = self.poll_interval
+        while not self.stopping:
+            try:
+                if self.run_once() is not None:
+                    backoff = self.poll_interval
+                    continue
+            except CampaignFailed:
+                # Logged and released by _send; on to the next campaign
+                backoff = self.poll_interval
+                continue
+            except PyMongoError as e:
+                # Database down or unreachable: keep the worker alive and try
+                # again later; a campaign it held is taken over when its lease runs out
+                logger.error("Worker %s could not reach the queue, retrying in %.0fs: %s", self.worker_id, backoff, e)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+                continue
+            backoff = self.poll_interval
+            if once:
+                break
+            self._stopping.wait(self.poll_interval)
+
+    def run_once(self, campaign_id=None):
+        # Claims and sends one campaign; None if there was nothing to claim,
+        # otherwise the addresses that failed. Raises CampaignFailed if the
+        # campaign stopped with an error.
+        journal = CampaignJournal.claim(self.db, self.worker_id, lease=self.lease, campaign_id=campaign_id)
+        if journal is None:
+            return None
+        return self._send(journal)
+
+    def _engine(self, journal):
+        campaign = journal.campaign
+        options = dict(self.engine_options)
+        options.update((k, v) for k, v in (campaign.get('options') or {}).items() if k in CAMPAIGN_OPTIONS)
+        label = f"campaign {journal.campaign_id}"
+        return SendEngine(self.senders, RecipientSource(campaign['source_path']), campaign['subject'],
+                          campaign['body'], campaign['attachments'], on_progress=ProgressLog(label),
+                          service_pool=self.service_pool, journal=journal, quota=self.quota,
+                          metrics=self.metrics, **options)
+
+    def _send(self, journal):
+        missing = [path for path in [journal.campaign['source_path']] + list(journal.campaign['attachments'])
+                   if not os.path.exists(path)]
+        if missing:
+            error = FileNotFoundError(f"Not found on {socket.gethostname()}: {', '.join(missing)}")
+            logger.error("Campaign %s: %s", journal.campaign_id, error)
+            journal.release(error=error)
+            raise CampaignFailed(f"Campaign {journal.campaign_id}: {error}") from error
+        engine = self.engine = self._engine(journal)
+        if self.stopping:
+            engine.cancel()
+        logger.info("Sending campaign %s (%s)", journal.campaign_id, journal.campaign.get('subject') or '(no subject)')
+        try:
+            failed = engine.run()
+        except Exception as e:
+            logger.exception("Campaign %s stopped", journal.campaign_id)
+            journal.release(error=e)
+            raise CampaignFailed(f"Campaign {journal.campaign_id} stopped: {e}") from e
+        finally:
+            self.engine = None
+        if self.stopping:
+            # Shutting down mid-campaign: let another worker carry on
+            journal.release()
+            logger.info("Campaign %s returned to the queue", journal.campaign_id)
+        else:
+            logger.info("Campaign %s %s, %d failed", journal.campaign_id,
+                        'cancelled' if engine.cancelled else 'completed', len(failed))
+        return failed
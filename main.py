@@ -1,11 +1,23 @@
 import sys
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # Headless commands (send, enqueue, worker) run without Qt or a display
+    import cli
+    sys.exit(cli.main(sys.argv[1:]))
+
 from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox
+from PyQt5.QtCore import QTimer
 from gui.login import LoginWindow
 from gui.admin_dashboard import AdminDashboard
 from gui.customer_dashboard import CustomerDashboard
 from dotenv import load_dotenv
 import os
-from session import save_session, load_session, clear_session
+import threading
+import logging
+from session import save_session, load_session, clear_session, revalidate_session
+from db import Database
+from gui import background, db_tasks
+from gui.db_tasks import DbExecutor
 
 # Load environment variables
 load_dotenv()
@@ -13,21 +25,40 @@ load_dotenv()
 # MongoDB connection string from .env
 MONGO_URI = os.getenv('MONGO_URI')
 
+# How often an open dashboard re-checks that its user is still allowed in
+REVALIDATE_INTERVAL_MS = 10 * 60 * 1000
+
 class MainController:
     def __init__(self, app, mongo_uri):
         self.app = app
-        self.mongo_uri = mongo_uri
+        self.database = Database(mongo_uri)
+        # Sends cancelled on close finish before the connection goes away
+        self.app.aboutToQuit.connect(background.wait_detached)
+        self.app.aboutToQuit.connect(db_tasks.shutdown)
+        self.app.aboutToQuit.connect(self.database.close)
+        threading.Thread(target=self.database.migrate, name="db-migrate", daemon=True).start()
         self.admin_dashboard = None
         self.customer_dashboard = None
         self.login_window = None
+        self.session_user = None
+        self.executor = DbExecutor()
+        self.revalidate_timer = QTimer()
+        self.revalidate_timer.setInterval(REVALIDATE_INTERVAL_MS)
+        self.revalidate_timer.timeout.connect(self.revalidate)
+        # A signed, unexpired session paints its dashboard straight away;
+        # the user is checked against the database right after.
         session_user = load_session()
         if session_user:
             self.on_login_success(session_user, save=False)
+            self.revalidate()
         else:
             self.show_login()
 
     def show_login(self):
-        self.login_window = LoginWindow(mongo_uri=self.mongo_uri)
+        if self.login_window:
+            self.login_window.close()
+            self.login_window.deleteLater()
+        self.login_window = LoginWindow(self.database)
         self.login_window.login_success = self.on_login_success
         self.login_window.logout_success = self.on_logout
         self.login_window.show()
@@ -35,24 +66,58 @@ class MainController:
     def on_login_success(self, user, save=True):
         if save:
             save_session(user)
+        self.session_user = user
+        self.revalidate_timer.start()
         if self.login_window:
             self.login_window.close()
         if user['role'] == 'admin':
-            self.admin_dashboard = AdminDashboard(self.mongo_uri)
+            self.admin_dashboard = AdminDashboard(self.database)
             self.admin_dashboard.logout_success = self.on_logout
             self.admin_dashboard.show()
         else:
-            self.customer_dashboard = CustomerDashboard(self.mongo_uri, user['username'])
+            self.customer_dashboard = CustomerDashboard(self.database, user['username'])
             self.customer_dashboard.logout_success = self.on_logout
             self.customer_dashboard.show()
 
-    def on_logout(self):
+    def revalidate(self):
+        if self.session_user is None:
+            return
+        user = self.session_user
+        self.executor.submit('revalidate', lambda: revalidate_session(self.database.db, user),
+                             lambda current: self.on_revalidated(user, current), self.on_revalidate_failed)
+
+    def on_revalidated(self, user, current):
+        if user is not self.session_user:
+            # Logged out or in as someone else meanwhile
+            return
+        if current is None:
+            clear_session()
+            self.close_dashboards()
+            QMessageBox.warning(None, "Session Ended", "Your account is no longer active. Please log in again.")
+            self.show_login()
+            return
+        # Refresh the snapshot and push the expiry out
+        save_session(current)
+        self.session_user = current
+
+    def on_revalidate_failed(self, error):
+        # Offline: keep the cached session until its token expires
+        logging.warning("Could not revalidate session: %s", error)
+
+    def close_dashboards(self):
+        self.session_user = None
+        self.revalidate_timer.stop()
         if self.admin_dashboard:
             self.admin_dashboard.close()
+            self.admin_dashboard.deleteLater()
             self.admin_dashboard = None
         if self.customer_dashboard:
             self.customer_dashboard.close()
+            self.customer_dashboard.deleteLater()
             self.customer_dashboard = None
+
+    def on_logout(self):
+        self.close_dashboards()
         self.show_login()
 
 if __name__ == "__main__":
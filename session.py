@@ -1,24 +1,115 @@
 import os
 import json
+import time
+import base64
+import hashlib
+import hmac
+import secrets
+
+SESSION_FILE = os.path.join(os.path.dirname(__file__), 'session.json')
+# Signing key, created on first use unless SESSION_SECRET is set
+KEY_FILE = os.path.join(os.path.dirname(__file__), 'session.key')
+SESSION_TTL = 7 * 24 * 3600
+
+# The part of the user document a session carries
+SNAPSHOT_FIELDS = ('_id', 'username', 'role', 'active')
 
 def _make_json_serializable(user):
-    user = dict(user)
+    user = {field: user[field] for field in SNAPSHOT_FIELDS if field in user}
     if '_id' in user:
         user['_id'] = str(user['_id'])
     return user
 
-SESSION_FILE = os.path.join(os.path.dirname(__file__), 'session.json')
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _write_private(path, data):
+    # Write-then-rename, readable by the owner only
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _signing_key():
+    secret = os.getenv('SESSION_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    try:
+        with open(KEY_FILE, 'rb') as f:
+            key = f.read()
+        if len(key) >= 32:
+            return key
+    except OSError:
+        pass
+    key = secrets.token_bytes(32)
+    _write_private(KEY_FILE, key)
+    return key
 
-def save_session(user):
-    user = _make_json_serializable(user)
-    with open(SESSION_FILE, 'w') as f:
-        json.dump(user, f)
+def _sign(payload, key):
+    return hmac.new(key, payload.encode('ascii'), hashlib.sha256).digest()
+
+def make_token(user, ttl=SESSION_TTL, now=None):
+    # base64(json).base64(HMAC-SHA256); the payload is the user snapshot plus expiry
+    now = time.time() if now is None else now
+    claims = {'user': _make_json_serializable(user), 'iat': int(now), 'exp': int(now + ttl)}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+    return f"{payload}.{_b64encode(_sign(payload, _signing_key()))}"
+
+def read_token(token, now=None):
+    # The user snapshot, or None if the token is malformed, tampered with or expired
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(_b64decode(signature), _sign(payload, _signing_key())):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (AttributeError, ValueError, TypeError):
+        return None
+    now = time.time() if now is None else now
+    if not isinstance(claims, dict) or not isinstance(claims.get('user'), dict) or claims.get('exp', 0) <= now:
+        return None
+    return claims['user']
+
+def is_allowed(user):
+    # Customers need an admin to activate them; admins always get in
+    return bool(user) and (user.get('role') == 'admin' or bool(user.get('active', False)))
+
+def save_session(user, ttl=SESSION_TTL):
+    data = json.dumps({'token': make_token(user, ttl)}).encode('utf-8')
+    _write_private(SESSION_FILE, data)
 
 def load_session():
-    if os.path.exists(SESSION_FILE):
+    # Only checks the signature and expiry, no database round trip: enough to
+    # paint the right dashboard at once while revalidate_session runs in the
+    # background. Anything unreadable (including sessions from older
+    # versions, which were unsigned) means logging in again.
+    try:
         with open(SESSION_FILE, 'r') as f:
-            return json.load(f)
-    return None
+            token = json.load(f).get('token')
+    except (OSError, ValueError, AttributeError):
+        token = None
+    user = read_token(token)
+    if user is None or not is_allowed(user):
+        clear_session()
+        return None
+    return user
+
+def revalidate_session(db, user):
+    # Fresh copy of the session user from the database, or None if the
+    # account is gone, was re-created, lost its role or was deactivated.
+    # Blocking; run it off the GUI thread.
+    from db import USER_SESSION_FIELDS
+    current = db.users.find_one({'username': user['username']}, USER_SESSION_FIELDS)
+    if current is None or not is_allowed(current):
+        return None
+    if user.get('_id') and str(current.get('_id')) != str(user['_id']):
+        return None
+    if current.get('role') != user.get('role'):
+        return None
+    return _make_json_serializable(current)
 
 def clear_session():
     if os.path.exists(SESSION_FILE):
@@ -0,0 +1,126 @@
+import base64
+import email
+import http.client
+import itertools
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Boundary of the multipart responses to batch requests
+BATCH_BOUNDARY = 'fake_gmail_batch'
+
+
+class FakeGmail:
+    # A local stand-in for the Gmail API: messages.send, resumable uploads
+    # and batch requests. Accounts are told apart by their bearer token.
+    # Every send may fail with a transient 429/503, accounts stop at
+    # `daily_limit` with Gmail's dailyLimitExceeded and recipients starting
+    # with "bad" are rejected.
+    def __init__(self, transient_rate, daily_limit, seed=0, limits=None):
+        self.transient_rate = transient_rate
+        self.daily_limit = daily_limit
+        # Per-account daily limits that differ from `daily_limit`
+        self.limits = dict(limits or {})
+        self.limited = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.delivered = {}
+        self.uploads = {}
+        self.sessions = itertools.count()
+
+    def deliver(self, account, raw):
+        with self.lock:
+            if self.random.random() < self.transient_rate:
+                status = self.random.choice([429, 503])
+                return status, {'error': {'code': status, 'message': 'Try again later',
+                                          'errors': [{'reason': 'rateLimitExceeded' if status == 429 else 'backendError'}]}}
+            if self.sent.get(account, 0) >= self.limits.get(account, self.daily_limit):
+                self.limited[account] = self.limited.get(account, 0) + 1
+                return 403, {'error': {'code': 403, 'message': 'Daily Limit Exceeded',
+                                       'errors': [{'reason': 'dailyLimitExceeded'}]}}
+            to = email.message_from_bytes(raw)['to'] or ''
+            if to.startswith('bad'):
+                return 400, {'error': {'code': 400, 'message': 'Invalid To header', 'errors': [{'reason': 'invalidArgument'}]}}
+            self.sent[account] = self.sent.get(account, 0) + 1
+            self.delivered[to] = self.delivered.get(to, 0) + 1
+            return 200, {'id': f'msg{sum(self.sent.values())}', 'labelIds': ['SENT']}
+
+
+def handler(gmail):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload=None, headers=None):
+            body = json.dumps(payload or {}).encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def _batch(self, account, body):
+            # multipart/mixed in, one application/http part per call; answered the same way
+            request = email.message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            parts = []
+            for part in request.get_payload():
+                _, _, call = part.get_payload().partition('\n')
+                raw = base64.urlsafe_b64decode(json.loads(email.message_from_string(call).get_payload())['raw'])
+                status, reply = gmail.deliver(account, raw)
+                data = json.dumps(reply)
+                parts.append(f"--{BATCH_BOUNDARY}\r\nContent-Type: application/http\r\n"
+                             f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                             f"HTTP/1.1 {status} {http.client.responses[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n{data}\r\n")
+            data = (''.join(parts) + f"--{BATCH_BOUNDARY}--\r\n").encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/mixed; boundary={BATCH_BOUNDARY}')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            account = self.headers.get('Authorization', '').rpartition(' ')[2]
+            body = self._body()
+            if url.path.endswith('/messages/send') and parse_qs(url.query).get('uploadType') == ['resumable']:
+                session = f'{next(gmail.sessions)}-{account}'
+                gmail.uploads[session] = bytearray()
+                host = self.headers.get('Host')
+                return self._reply(200, headers={'Location': f'http://{host}/upload/session/{session}'})
+            if url.path.endswith('/messages/send'):
+                raw = base64.urlsafe_b64decode(json.loads(body)['raw'])
+                return self._reply(*gmail.deliver(account, raw))
+            if url.path.split('/')[1] == 'batch':
+                return self._batch(account, body)
+            self._reply(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+        def do_PUT(self):
+            # Resumable media upload: chunks arrive with Content-Range
+            session = urlparse(self.path).path.rpartition('/')[2]
+            data = gmail.uploads.get(session)
+            if data is None:
+                return self._reply(404, {'error': {'code': 404, 'message': 'Unknown upload'}})
+            data += self._body()
+            total = self.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit() and len(data) >= int(total):
+                del gmail.uploads[session]
+                return self._reply(*gmail.deliver(session.partition('-')[2], bytes(data)))
+            self._reply(308, headers={'Range': f'bytes=0-{len(data) - 1}'})
+
+    return Handler
+
+
+def serve(gmail):
+    # Starts the fake on a free local port; returns (server, api_endpoint)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(gmail))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/'
@@ -0,0 +1,160 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from mailer.dispatcher import QuotaExhausted
+from mailer.engine import SendEngine
+from mailer.gmail_service import ServicePool
+from mailer.quota import QuotaManager
+from mailer.retry import QUOTA, PERMANENT, TRANSIENT, RetryPolicy, classify, quota_exhausted, retry_after
+from mailer.validation import RecipientValidator
+from tests.fake_gmail import FakeGmail, serve
+
+
+def http_error(status, message, reason, headers=None):
+    resp = httplib2.Response(dict({'status': status}, **(headers or {})))
+    content = json.dumps({'error': {'code': status, 'message': message, 'errors': [{'reason': reason}]}})
+    return HttpError(resp, content.encode('utf-8'))
+
+
+def gmail_time(delta):
+    return (datetime.datetime.utcnow() + delta).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_transient(self):
+        self.assertEqual(classify(http_error(503, "Backend Error", 'backendError')), TRANSIENT)
+        self.assertEqual(classify(http_error(429, "Too many requests", 'rateLimitExceeded')), TRANSIENT)
+        self.assertEqual(classify(ConnectionResetError("reset")), TRANSIENT)
+
+    def test_near_retry_time_is_transient(self):
+        soon = gmail_time(datetime.timedelta(minutes=1))
+        error = http_error(429, f"User-rate limit exceeded.  Retry after {soon}", 'rateLimitExceeded')
+        self.assertEqual(classify(error), TRANSIENT)
+        self.assertAlmostEqual(retry_after(error), 60, delta=2)
+        self.assertEqual(classify(http_error(429, "Slow down", 'rateLimitExceeded', {'retry-after': '30'})), TRANSIENT)
+
+    def test_distant_retry_time_is_quota(self):
+        later = gmail_time(datetime.timedelta(hours=5))
+        error = http_error(429, f"User-rate limit exceeded.  Retry after {later}", 'rateLimitExceeded')
+        self.assertEqual(classify(error), QUOTA)
+        until = quota_exhausted(error).until
+        self.assertAlmostEqual((until - datetime.datetime.utcnow()).total_seconds(), 5 * 3600, delta=2)
+
+    def test_retry_after_http_date(self):
+        at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=2)
+        error = http_error(429, "Slow down", 'rateLimitExceeded',
+                           {'retry-after': at.strftime('%a, %d %b %Y %H:%M:%S GMT')})
+        self.assertAlmostEqual(retry_after(error), 7200, delta=2)
+        self.assertEqual(classify(error), QUOTA)
+
+    def test_daily_limit_is_quota(self):
+        error = http_error(403, "Daily Limit Exceeded", 'dailyLimitExceeded')
+        self.assertEqual(classify(error), QUOTA)
+        self.assertIsNone(quota_exhausted(error).until)
+        self.assertEqual(classify(QuotaExhausted("All sender accounts have reached their limit")), QUOTA)
+
+    def test_limit_phrase_in_a_rejection_is_permanent(self):
+        error = http_error(400, "Recipient address rejected: sending limit", 'invalidArgument')
+        self.assertEqual(classify(error), PERMANENT)
+        self.assertEqual(classify(ValueError("over the limit")), PERMANENT)
+
+
+class QuotaBlockTest(unittest.TestCase):
+    def test_blocked_until_retry_time(self):
+        quota = QuotaManager()
+        sender = {'email': 'sender@example.com', 'limit': 500}
+        quota.block(sender['email'], until=datetime.datetime.utcnow() + datetime.timedelta(minutes=10))
+        self.assertEqual(quota.remaining(sender), 0)
+        quota.block(sender['email'], until=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+        self.assertEqual(quota.remaining(sender), 0, "a shorter block must not lift a longer one")
+
+    def test_block_expires(self):
+        quota = QuotaManager()
+        sender = {'email': 'sender@example.com', 'limit': 500}
+        quota.block(sender['email'], until=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+        self.assertEqual(quota.remaining(sender), 500)
+
+
+class FakeGmailSendTest(unittest.TestCase):
+    # Whole campaigns through SendEngine against tests/fake_gmail.py
+
+    def send(self, gmail, recipients, senders=2, batch_size=0, quota=None, attachments=(), max_message_memory=None):
+        server, endpoint = serve(gmail)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.senders = [{'email': f'sender{i}@example.com', 'creds': Credentials(token=f'sender{i}@example.com'),
+                         'token_path': f'sender{i}', 'limit': 500} for i in range(senders)]
+        options = {'max_message_memory': max_message_memory} if max_message_memory else {}
+        engine = SendEngine(self.senders, recipients, "Subject", "<p>Hello</p>", list(attachments), concurrency=3,
+                            batch_size=batch_size, service_pool=ServicePool(api_endpoint=endpoint),
+                            validator=RecipientValidator(check_deliverability=False), quota=quota,
+                            retry=RetryPolicy(attempts=8, base_delay=0.01, max_delay=0.05), **options)
+        return engine, engine.run()
+
+    def assertDeliveredOnce(self, gmail, addresses):
+        self.assertEqual(set(gmail.delivered), set(addresses))
+        self.assertEqual([a for a, n in gmail.delivered.items() if n > 1], [])
+
+    def check_transient_errors(self, batch_size):
+        gmail = FakeGmail(transient_rate=0.3, daily_limit=1000)
+        good = [f'user{i}@example.com' for i in range(60)]
+        bad = [f'bad{i}@example.com' for i in range(3)]
+        engine, failed = self.send(gmail, good + bad, batch_size=batch_size)
+        self.assertDeliveredOnce(gmail, good)
+        self.assertEqual(sorted(failed), sorted(bad))
+        self.assertTrue(engine.metrics.snapshot()['retries'])
+
+    def test_transient_errors_are_retried(self):
+        self.check_transient_errors(batch_size=0)
+
+    def test_transient_errors_are_retried_in_batches(self):
+        self.check_transient_errors(batch_size=10)
+
+    def check_quota_requeue(self, batch_size):
+        # sender0 runs out after 5 sends; its recipients must move to sender1
+        gmail = FakeGmail(transient_rate=0.1, daily_limit=100, limits={'sender0@example.com': 5})
+        quota = QuotaManager(rate=1000, burst=1000)
+        recipients = [f'user{i}@example.com' for i in range(50)]
+        engine, failed = self.send(gmail, recipients, batch_size=batch_size, quota=quota)
+        self.assertEqual(failed, [])
+        self.assertDeliveredOnce(gmail, recipients)
+        self.assertEqual(gmail.sent['sender0@example.com'], 5)
+        self.assertTrue(gmail.limited['sender0@example.com'])
+        self.assertEqual(quota.remaining(self.senders[0]), 0)
+        self.assertEqual(quota.remaining(self.senders[1]), 500 - 45)
+
+    def test_quota_hit_recipients_move_to_another_account(self):
+        self.check_quota_requeue(batch_size=0)
+
+    def test_quota_hit_recipients_move_to_another_account_in_batches(self):
+        self.check_quota_requeue(batch_size=10)
+
+    def test_recipients_beyond_every_quota_fail(self):
+        gmail = FakeGmail(transient_rate=0.0, daily_limit=20)
+        recipients = [f'user{i}@example.com' for i in range(50)]
+        engine, failed = self.send(gmail, recipients, quota=QuotaManager(rate=1000, burst=1000))
+        self.assertEqual(sum(gmail.sent.values()), 40)
+        self.assertEqual(len(failed), 10)
+        self.assertEqual(set(failed) | set(gmail.delivered), set(recipients))
+
+    def test_streamed_messages_are_retried(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(os.urandom(1536 * 1024))
+        self.addCleanup(os.remove, f.name)
+        gmail = FakeGmail(transient_rate=0.3, daily_limit=1000)
+        recipients = [f'user{i}@example.com' for i in range(5)]
+        engine, failed = self.send(gmail, recipients, attachments=[f.name], max_message_memory=1024 * 1024)
+        self.assertTrue(engine.template.streamed)
+        self.assertEqual(failed, [])
+        self.assertDeliveredOnce(gmail, recipients)
+
+
+if __name__ == '__main__':
+    unittest.main()